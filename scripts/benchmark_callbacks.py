@@ -0,0 +1,344 @@
+"""
+Callback latency benchmarks for the dashboard.
+
+Generates synthetic `summary_df` variants with the same schema at 1x, 10x, 100x and
+1000x the real data (more countries and more years), then for each one drives the
+figure callbacks both directly and through Flask's `/_dash-update-component`
+endpoint. Reports p50/p95/p99 latency, response payload bytes and peak memory,
+and saves everything as JSON so later runs can be compared against a baseline.
+
+Each scale runs in its own process, since the app loads its dataset at import.
+The figure cache is disabled, and the shared selections and cached row lookups are
+cleared before each timed call, so every call measures a full build. With `--warm`
+those two caches are kept, so repeats of the rotating inputs measure warm-cache
+latency instead.
+
+Usage (from the repo root):
+    python scripts/benchmark_callbacks.py [--scales 1 10 100] [--repeats 30] [--warm] [--output results.json]
+"""
+
+import argparse
+import inspect
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURES = [
+    "gdp_per_capita",
+    "family",
+    "health_life_expectancy",
+    "freedom",
+    "perceptions_of_corruption",
+    "generosity",
+    "dystopia_residual",
+]
+
+
+def synthetic_summary_df(base_df, scale, seed=0):
+    """`base_df` grown to roughly `scale` times as many rows, with the same schema.
+
+    Years grow by about sqrt(scale) (capped at 20x) and countries make up the rest.
+    New countries are noisy copies of real ones ("Canada 3"), keeping the real
+    country code so the map still has somewhere to draw them.
+    """
+    if scale == 1:
+        return base_df.copy()
+
+    rng = np.random.default_rng(seed)
+    year_factor = min(int(round(math.sqrt(scale))), 20)
+    country_factor = int(math.ceil(scale / year_factor))
+
+    base_years = sorted(base_df.year.unique())
+    n_years = len(base_years) * year_factor
+    years = np.arange(max(base_years) - n_years + 1, max(base_years) + 1)
+
+    # One template row per real country, reused for every synthetic copy and year
+    template = base_df.drop_duplicates("country").reset_index(drop=True)
+    copies = []
+    for copy in range(country_factor):
+        df = template.copy()
+        if copy:
+            df["country"] = df.country + f" {copy}"
+        copies.append(df)
+    countries = pd.concat(copies, ignore_index=True)
+
+    rows = countries.loc[np.repeat(countries.index, len(years))].reset_index(drop=True)
+    rows["year"] = np.tile(years, len(countries))
+    noise = rng.normal(1.0, 0.05, size=(len(rows), len(FEATURES)))
+    rows[FEATURES] = rows[FEATURES].to_numpy() * noise
+    rows["happiness_score"] = rows[FEATURES].sum(axis=1)
+    rows["happiness_rank"] = (
+        rows.groupby("year").happiness_score.rank(ascending=False, method="min")
+    ).astype(int)
+    return rows.loc[:, base_df.columns]
+
+
+def percentiles(samples):
+    """p50/p95/p99/mean of latency samples, in milliseconds"""
+    ms = np.array(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "n": len(ms),
+    }
+
+
+def measure(func, inputs, repeats, reset=None):
+    """Latency stats, payload bytes and tracemalloc peak for `func` over rotating `inputs`,
+    calling `reset` (untimed) before each call if given
+    """
+    reset = reset or (lambda: None)
+    payload = func(*inputs[0])
+    samples = []
+    for i in range(repeats):
+        reset()
+        start = time.perf_counter()
+        func(*inputs[i % len(inputs)])
+        samples.append(time.perf_counter() - start)
+
+    reset()
+    tracemalloc.start()
+    func(*inputs[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = percentiles(samples)
+    stats["peak_memory_bytes"] = peak
+    if isinstance(payload, (bytes, str)):
+        stats["payload_bytes"] = len(payload)
+    return stats
+
+
+def run_worker(repeats, warm=False):
+    """Benchmark the app as loaded from `HAPPYDASH_DATA_DIR`; runs inside the worker process"""
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    import src.app as app_module
+
+    import_seconds = time.perf_counter() - start
+
+    snapshot = app_module.snapshots.current
+    countries = list(snapshot.engine.countries)
+    years = [int(y) for y in snapshot.engine.years]
+    year_ranges = [
+        [years[0], years[-1]],
+        [years[len(years) // 2], years[-1]],
+        [years[0], years[min(1, len(years) - 1)]],
+    ]
+    selections = [
+        [c for c in ["Canada", "Switzerland", "China"] if c in countries],
+        countries[:10],
+        countries[::7][:25],
+    ]
+    inputs = [(s, FEATURES, r) for s in selections for r in year_ranges]
+
+    def cold():
+        # The figure cache is off; these would otherwise answer every repeat
+        snapshot.selections.clear()
+        snapshot.engine.clear_cache()
+
+    reset = None if warm else cold
+
+    # Bypass Dash's wrapper and any caching/instrumentation to time the builders themselves
+    build_detail_figures = inspect.unwrap(app_module.build_detail_figures)
+    build_overall_figure = inspect.unwrap(app_module.build_overall_figure)
+    happiness_map = inspect.unwrap(app_module.happiness_map)
+
+    direct = {
+        "filter_df": measure(
+            lambda c, f, r: app_module.filter_df(snapshot.df, c, f, r),
+            inputs,
+            repeats,
+            reset,
+        ),
+        "build_detail_figures": measure(build_detail_figures, inputs, repeats, reset),
+        "build_overall_figure": measure(build_overall_figure, inputs, repeats, reset),
+        "happiness_map": measure(
+            lambda c, f, r: happiness_map(r, "summary_view", None),
+            inputs,
+            repeats,
+            reset,
+        ),
+    }
+
+    client = app_module.app.server.test_client()
+
+    def dash_request(output, values, state=()):
+        # Multi-output callbacks are addressed as "..id.prop...id.prop.."
+        outputs = [
+            {"id": o.split(".")[0], "property": o.split(".")[1]}
+            for o in output.strip(".").split("...")
+        ]
+
+        def post(*args):
+            body = {
+                "output": output,
+                "outputs": outputs if len(outputs) > 1 else outputs[0],
+                "inputs": [
+                    {"id": i, "property": p, "value": v} for (i, p), v in values(*args)
+                ],
+                "state": [{"id": i, "property": p, "value": v} for (i, p), v in state],
+                "changedPropIds": [],
+            }
+            response = client.post("/_dash-update-component", json=body)
+            assert response.status_code == 200, response.status_code
+            return response.data
+
+        return post
+
+    def common(c, f, r):
+        return [
+            (("country-select-1", "value"), c),
+            (("settled-features", "data"), f),
+            (("settled-years", "data"), r),
+        ]
+
+    http = {
+        "build_detail_plots": measure(
+            dash_request(
+                "detail-figures-update.data",
+                lambda c, f, r: common(c, f, r)
+                + [
+                    (("tabs", "active_tab"), "detail_view"),
+                    (("detail-resync", "data"), None),
+                ],
+                state=[(("detail-rendered", "data"), None)],
+            ),
+            inputs,
+            repeats,
+            reset,
+        ),
+        "build_overall_graph": measure(
+            dash_request(
+                "..happiness-bar-chart.figure...bar-rendered.data..",
+                lambda c, f, r: common(c, f, r)
+                + [(("tabs", "active_tab"), "summary_view")],
+                state=[(("bar-rendered", "data"), None)],
+            ),
+            inputs,
+            repeats,
+            reset,
+        ),
+        "happiness_map": measure(
+            dash_request(
+                "..happiness-map.figure...map-rendered.data..",
+                lambda c, f, r: [
+                    (("settled-years", "data"), r),
+                    (("tabs", "active_tab"), "summary_view"),
+                ],
+                state=[(("map-rendered", "data"), None)],
+            ),
+            inputs,
+            repeats,
+            reset,
+        ),
+    }
+
+    return {
+        "rows": len(snapshot.df),
+        "countries": len(countries),
+        "years": len(years),
+        "warm": warm,
+        "import_seconds": import_seconds,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "direct": direct,
+        "http": http,
+    }
+
+
+def run_scale(base_df, scale, repeats, workdir, warm=False):
+    """Write the synthetic dataset for `scale` and benchmark it in a fresh process"""
+    sys.path.insert(0, os.path.join(ROOT, "scripts"))
+    from build_dataset import write_feather
+
+    data_dir = os.path.join(workdir, f"scale_{scale}")
+    os.makedirs(data_dir, exist_ok=True)
+    df = synthetic_summary_df(base_df, scale)
+    df.to_csv(os.path.join(data_dir, "summary_df.csv"), index=False)
+    write_feather(df, os.path.join(data_dir, "summary_df.feather"))
+
+    env = dict(
+        os.environ,
+        HAPPYDASH_DATA_DIR=data_dir,
+        HAPPYDASH_FIGURE_CACHE_MB="0",
+        HAPPYDASH_FIGURE_CACHE_DB="",
+    )
+    result = subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--worker",
+            "--repeats",
+            str(repeats),
+        ]
+        + (["--warm"] if warm else []),
+        cwd=ROOT,
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    )
+    return json.loads(result.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100, 1000])
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="keep the selection and row caches between calls",
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.repeats, args.warm)))
+        return
+
+    base_df = pd.read_csv(os.path.join(ROOT, "data", "processed", "summary_df.csv"))
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "repeats": args.repeats,
+        "warm": args.warm,
+        "scales": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            print(f"Scale {scale}x ...", file=sys.stderr)
+            result = run_scale(base_df, scale, args.repeats, workdir, args.warm)
+            results["scales"][str(scale)] = result
+            for mode in ["direct", "http"]:
+                for name, stats in result[mode].items():
+                    print(
+                        f"  {mode:6} {name:22} p50 {stats['p50_ms']:8.2f} ms"
+                        f"  p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms"
+                        + (
+                            f"  {stats['payload_bytes']:>10} B"
+                            if "payload_bytes" in stats
+                            else ""
+                        ),
+                        file=sys.stderr,
+                    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,172 +1,534 @@
 """
 Preprocessing of World Happiness Report Data
 For data from :https://www.kaggle.com/unsdsn/world-happiness.
-Download all csv's and place into `data/raw` folder, specify this as `base_path`
-Check `years` list to contain all files you wish to process.
+Download all csv's and place into `data/raw` folder, then add an entry for each
+new year to `YEAR_SCHEMAS` describing how its columns map onto the summary schema.
 
 Due to poor Kaggle data quality `Dystopia + Residual` is missing in 2018, 2019. These were accessed from:
 2019: https://s3.amazonaws.com/happiness-report/2019/Chapter2OnlineData.xls
 2018: https://s3.amazonaws.com/happiness-report/2018/WHR2018Chapter2OnlineData.xls
 
-Gets country codes for chloropleth plotting from:
+Country codes for chloropleth plotting are read from the vendored `data/raw/country_codes.csv`,
+a copy of (the countries we use from):
 "https://raw.githubusercontent.com/plotly/datasets/master/2014_world_gdp_with_codes.csv"
+Run with `--refresh-country-codes` to download it again. Countries the report names
+differently go in `COUNTRY_ALIASES` or `COUNTRY_NAME_FIXES`, and ones the table lacks
+in `EXTRA_COUNTRY_CODES`. The build stops on a country it can't find a code for,
+unless run with `--allow-unmatched`, which leaves such countries out of the outputs.
+
+The build runs in stages. Each year is cleaned on its own (in a process pool) and its
+output is cached in `data/interim` under a hash of its inputs, so re-running after
+adding one new year only processes that year. The combined outputs are only rewritten
+when one of their inputs changed.
+
+Respondent-level survey files can be streamed in with `--microdata`, see `microdata.py`.
+
+Usage (from anywhere):
+    python scripts/build_dataset.py [--years 2018 2019] [--jobs 4] [--output-dir DIR] [--force]
+                                    [--microdata respondents.csv ...] [--allow-unmatched]
 
 
 By: Dustin Andrews
 Date: Jan 18,2021
 """
-import pandas as pd
+
+import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from microdata import summarize_microdata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAW_DIR = os.path.join(ROOT, "data", "raw")
+INTERIM_DIR = os.path.join(ROOT, "data", "interim")
+PROCESSED_DIR = os.path.join(ROOT, "data", "processed")
+
+COUNTRY_CODES_FILE = os.path.join(RAW_DIR, "country_codes.csv")
+COUNTRY_CODES_URL = "https://raw.githubusercontent.com/plotly/datasets/master/2014_world_gdp_with_codes.csv"
+
+# Bump when the cleaning code changes so cached stage outputs are rebuilt
+PIPELINE_VERSION = 1
+
+# How each year's (cleaned, lower-cased) columns map onto the summary schema.
+# `dystopia_file` joins `dystopia_residual` from a separate file, because of janky
+# Kaggle standards for 2018 and 2019
+_RENAME_2015 = {
+    "economy_gdp_per_capita": "gdp_per_capita",
+    "trust_government_corruption": "perceptions_of_corruption",
+}
+_RENAME_2018 = {
+    "overall_rank": "happiness_rank",
+    "score": "happiness_score",
+    "healthy_life_expectancy": "health_life_expectancy",
+    "country_or_region": "country",
+    "social_support": "family",
+    "freedom_to_make_life_choices": "freedom",
+}
+YEAR_SCHEMAS = {
+    "2015": {"rename": _RENAME_2015, "drop": ["standard_error"]},
+    "2016": {
+        "rename": _RENAME_2015,
+        "drop": ["lower_confidence_interval", "upper_confidence_interval"],
+    },
+    "2017": {
+        "rename": {
+            "economy__gdp_per_capita_": "gdp_per_capita",
+            "health__life_expectancy_": "health_life_expectancy",
+            "trust__government_corruption_": "perceptions_of_corruption",
+        },
+        "drop": ["whisker_low", "whisker_high"],
+    },
+    "2018": {"rename": _RENAME_2018, "dystopia_file": "2018_dystopia_residual.csv"},
+    "2019": {"rename": _RENAME_2018, "dystopia_file": "2019_dystopia_residual.csv"},
+}
+
+# Spellings of the same country that differ between years, or between a year and its
+# dystopia file, unified before they are joined
+COUNTRY_ALIASES = {
+    "North Macedonia": "Macedonia",
+    "Northern Cyprus": "North Cyprus",
+    "Trinidad & Tobago": "Trinidad and Tobago",
+    "Taiwan Province of China": "Taiwan",
+    "Hong Kong SAR, China": "Hong Kong",
+}
+
+# Fix some country names so they match the country code table
+COUNTRY_NAME_FIXES = {
+    "Hong Kong S.A.R., China": "Hong Kong",
+    "Somaliland region": "Somaliland Region",
+    "Congo (Kinshasa)": "Congo, Democratic Republic of the",
+    "Congo (Brazzaville)": "Congo, Republic of the",
+    "South Korea": "Korea, South",
+    "North Cyprus": "Cyprus",
+    "Myanmar": "Burma",
+    "Ivory Coast": "Cote d'Ivoire",
+}
+
+# Codes of countries in the report that the country code table lacks
+EXTRA_COUNTRY_CODES = {"Gambia": "GMB", "Palestinian Territories": "PSE"}
+
+# Countries without an ISO code, which can't be placed on the map and are left out
+NO_COUNTRY_CODE = ["Somaliland Region"]
+
+
+class UnmatchedCountries(ValueError):
+    """Countries without a country code, see `combine_years`"""
+
+
+def file_hash(path):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_hash(*parts):
+    """Content hash identifying a stage output from the hashes/values of its inputs"""
+    blob = json.dumps([PIPELINE_VERSION, *parts], sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
 
-base_path = "../data/raw/"
-dystopia_file_2018 = "../data/raw/2018_dystopia_residual.csv"
-dystopia_file_2019 = "../data/raw/2019_dystopia_residual.csv"
-world_polygons_df = pd.read_csv(
-    "https://raw.githubusercontent.com/plotly/datasets/master/2014_world_gdp_with_codes.csv"
-)
+def year_inputs(year, raw_dir=RAW_DIR):
+    """Input files of the per-year stage for `year`"""
+    schema = YEAR_SCHEMAS[year]
+    paths = [os.path.join(raw_dir, year + ".csv")]
+    if "dystopia_file" in schema:
+        paths.append(os.path.join(raw_dir, schema["dystopia_file"]))
+    return paths
 
-path_write_out = "../data/processed/"
-years = ["2015", "2016", "2017", "2018", "2019"]
-yearly_dict = {}
 
-for y in years:
+def process_year(year, raw_dir=RAW_DIR):
+    """Read one year's raw csv and map it onto the summary schema.
+
+    Parameters
+    ----------
+    year : str
+        Key into `YEAR_SCHEMAS`
+    raw_dir : str
+        Directory with the raw yearly csv's
+
+    Returns
+    -------
+    pandas.DataFrame
+        Cleaned rows for that year, with a `year` column
+    """
+    schema = YEAR_SCHEMAS[year]
+
     # Get csv and rename messy columns to start
-    yearly_df = pd.read_csv(os.path.join(base_path, y + ".csv"))
+    yearly_df = pd.read_csv(os.path.join(raw_dir, year + ".csv"))
     yearly_df.columns = (
         yearly_df.columns.str.lower()
         .str.replace("[()]", "", regex=True)
-        .str.replace(" |[.]", "_")
-    )
-    yearly_dict[y] = yearly_df
-    cols = list(yearly_dict[y].columns)
-    # print(cols)
-
-
-# Have to manually fix each year in a different way
-yearly_dict["2015"].rename(
-    columns=(
-        {
-            "economy_gdp_per_capita": "gdp_per_capita",
-            "trust_government_corruption": "perceptions_of_corruption",
-        }
-    ),
-    inplace=True,
-)
-yearly_dict["2015"].drop(columns=["standard_error"], inplace=True)
-
-
-yearly_dict["2016"].rename(
-    columns=(
-        {
-            "economy_gdp_per_capita": "gdp_per_capita",
-            "trust_government_corruption": "perceptions_of_corruption",
-        }
-    ),
-    inplace=True,
-)
-yearly_dict["2016"].drop(
-    columns=[
-        "lower_confidence_interval",
-        "upper_confidence_interval",
-    ],
-    inplace=True,
-)
-
-
-yearly_dict["2017"].rename(
-    columns=(
-        {
-            "economy__gdp_per_capita_": "gdp_per_capita",
-            "health__life_expectancy_": "health_life_expectancy",
-            "trust__government_corruption_": "perceptions_of_corruption",
-        }
-    ),
-    inplace=True,
-)
-
-yearly_dict["2017"].drop(
-    columns=["whisker_low", "whisker_high"],
-    inplace=True,
-)
-
-# Because of janky Kaggle standards, join in `dystopia_residual` from separate file
-# For 2018 and 2019 data.....
-dystopia_2018 = pd.read_csv(dystopia_file_2018)
-dystopia_2018.columns = ["country", "dystopia_residual"]
-
-yearly_dict["2018"].rename(
-    columns=(
-        {
-            "overall_rank": "happiness_rank",
-            "score": "happiness_score",
-            "healthy_life_expectancy": "health_life_expectancy",
-            "country_or_region": "country",
-            "social_support": "family",
-            "freedom_to_make_life_choices": "freedom",
-        }
-    ),
-    inplace=True,
-)
-
-df_2018 = yearly_dict["2018"]
-yearly_dict["2018"] = pd.merge(df_2018, dystopia_2018, on="country")
-
-
-dystopia_2019 = pd.read_csv(dystopia_file_2019)
-dystopia_2019.columns = ["country", "dystopia_residual"]
-yearly_dict["2019"].rename(
-    columns=(
-        {
-            "overall_rank": "happiness_rank",
-            "score": "happiness_score",
-            "healthy_life_expectancy": "health_life_expectancy",
-            "country_or_region": "country",
-            "social_support": "family",
-            "freedom_to_make_life_choices": "freedom",
-        }
-    ),
-    inplace=True,
-)
-df_2019 = yearly_dict["2019"]
-yearly_dict["2019"] = pd.merge(df_2019, dystopia_2019, on="country")
-
-
-# Stick them together in one big dataframe
-summary_df = pd.DataFrame()
-for k, v in yearly_dict.items():
-    temp_df = v
-    v["year"] = k
-    summary_df = pd.concat([summary_df, v], axis=0)
-    print(v.columns)
-
-# Fix some country names
-summary_df.loc[summary_df.country == "Hong Kong S.A.R., China", "country"] = "Hong Kong"
-summary_df.loc[
-    summary_df.country == "Somaliland region", "country"
-] = "Somaliland Region"
-summary_df.loc[
-    summary_df.country == "Congo (Kinshasa)", "country"
-] = "Congo, Democratic Republic of the"
-summary_df.loc[
-    summary_df.country == "Congo (Brazzaville)", "country"
-] = "Congo, Republic of the"
-summary_df.loc[summary_df.country == "South Korea", "country"] = "Korea, South"
-summary_df.loc[summary_df.country == "North Cyprus", "country"] = "Cyprus"
-summary_df.loc[summary_df.country == "Myanmar", "country"] = "Burma"
-summary_df.loc[summary_df.country == "Ivory Coast", "country"] = "Cote d'Ivoire"
-
-
-# Fix region missing in some years. Drop the column then rejoin a lookup table onto full dataframe
-region_lookup = summary_df.loc[:, ["country", "region"]].drop_duplicates().dropna()
-summary_df.drop(columns=["region"], inplace=True)
-summary_df = pd.merge(summary_df, region_lookup, on="country")
-
-# Join on country codes, Plotly can use this to plot country boundaries....
-world_polygons_df.rename(
-    {"COUNTRY": "country", "CODE": "country_code"}, axis=1, inplace=True
-)
-world_polygons_df.drop("GDP (BILLIONS)", axis=1, inplace=True)
-
-summary_df = pd.merge(summary_df, world_polygons_df, on="country", how="left")
-
-summary_df.to_csv(os.path.join(path_write_out, "summary_df.csv"), index=False)
+        .str.replace(" |[.]", "_", regex=True)
+    )
+    yearly_df = yearly_df.rename(columns=schema.get("rename", {})).drop(
+        columns=schema.get("drop", [])
+    )
+
+    if "dystopia_file" in schema:
+        dystopia_df = pd.read_csv(os.path.join(raw_dir, schema["dystopia_file"]))
+        dystopia_df.columns = ["country", "dystopia_residual"]
+        yearly_df["country"] = yearly_df.country.replace(COUNTRY_ALIASES)
+        dystopia_df["country"] = dystopia_df.country.replace(COUNTRY_ALIASES)
+        yearly_df = pd.merge(yearly_df, dystopia_df, on="country")
+
+    yearly_df["year"] = year
+    return yearly_df
+
+
+def build_years(years, raw_dir=RAW_DIR, cache_dir=INTERIM_DIR, jobs=None):
+    """Run the per-year stage, reusing cached outputs whose inputs haven't changed.
+
+    Parameters
+    ----------
+    years : list
+        Years (keys of `YEAR_SCHEMAS`) to process
+    raw_dir : str
+        Directory with the raw yearly csv's
+    cache_dir : str
+        Where per-year stage outputs are cached
+    jobs : int, optional
+        Worker processes for the years that need processing, default one per CPU
+
+    Returns
+    -------
+    dict
+        year -> (stage hash, cleaned dataframe)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    hashes = {
+        y: stage_hash(
+            "year",
+            y,
+            YEAR_SCHEMAS[y],
+            COUNTRY_ALIASES,
+            [file_hash(p) for p in year_inputs(y, raw_dir)],
+        )
+        for y in years
+    }
+    cache_paths = {
+        y: os.path.join(cache_dir, f"year_{y}_{hashes[y]}.pkl") for y in years
+    }
+
+    results = {}
+    todo = []
+    for y in years:
+        if os.path.exists(cache_paths[y]):
+            results[y] = pd.read_pickle(cache_paths[y])
+        else:
+            todo.append(y)
+
+    if todo:
+        print(f"Processing years: {', '.join(todo)}")
+        if jobs == 1 or len(todo) == 1:
+            processed = [process_year(y, raw_dir) for y in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                processed = list(pool.map(process_year, todo, [raw_dir] * len(todo)))
+
+        for y, yearly_df in zip(todo, processed):
+            yearly_df.to_pickle(cache_paths[y])
+            results[y] = yearly_df
+
+    return {y: (hashes[y], results[y]) for y in years}
+
+
+def load_country_codes(refresh=False):
+    """Country -> ISO code lookup from the vendored table, downloading it again if `refresh`"""
+    if refresh or not os.path.exists(COUNTRY_CODES_FILE):
+        codes_df = pd.read_csv(COUNTRY_CODES_URL).loc[:, ["COUNTRY", "CODE"]]
+        codes_df.to_csv(COUNTRY_CODES_FILE, index=False)
+
+    codes_df = pd.read_csv(COUNTRY_CODES_FILE).rename(
+        {"COUNTRY": "country", "CODE": "country_code"}, axis=1
+    )
+    extra_df = pd.DataFrame(
+        list(EXTRA_COUNTRY_CODES.items()), columns=["country", "country_code"]
+    )
+    return pd.concat([codes_df, extra_df], ignore_index=True)
+
+
+def fix_country_names(countries):
+    """`countries` renamed through `COUNTRY_ALIASES` and `COUNTRY_NAME_FIXES`"""
+    return countries.replace(COUNTRY_ALIASES).replace(COUNTRY_NAME_FIXES)
+
+
+def merge_microdata(summary_df, microdata_df):
+    """Replace the pre-aggregated rows of each country-year in `microdata_df` with its row.
+
+    Only those country-years are replaced; other rows sharing a (country, year), such
+    as the two Cyprus rows left by the name fixes, are kept. Columns the respondent
+    files don't provide, or leave empty, keep the pre-aggregated values, so a file with
+    only happiness scores doesn't blank out the features. `happiness_rank` is ranked
+    again within each year the microdata covers, over the combined rows.
+
+    Parameters
+    ----------
+    summary_df : pandas.DataFrame
+        Cleaned yearly rows, with country names already fixed
+    microdata_df : pandas.DataFrame
+        Rows from `summarize_microdata`
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    keys = ["country", "year"]
+    microdata_df = microdata_df.drop(columns=["happiness_rank"], errors="ignore")
+    microdata_df["country"] = fix_country_names(microdata_df.country)
+
+    replaced = pd.MultiIndex.from_frame(summary_df[keys]).isin(
+        pd.MultiIndex.from_frame(microdata_df[keys])
+    )
+    previous = (
+        summary_df[replaced].drop_duplicates(subset=keys, keep="last").set_index(keys)
+    )
+    microdata_df = microdata_df.set_index(keys).combine_first(previous).reset_index()
+    summary_df = pd.concat([summary_df[~replaced], microdata_df], ignore_index=True)
+
+    # Rank against the pre-aggregated rows too, not only among the replaced ones.
+    # Ties keep the report's order, which lists them by its published rank
+    ranked = summary_df.year.isin(microdata_df.year)
+    ranks = summary_df.groupby("year").happiness_score.rank(
+        ascending=False, method="first"
+    )
+    summary_df["happiness_rank"] = (
+        ranks.where(ranked, summary_df.happiness_rank).round().astype("Int64")
+    )
+    return summary_df
+
+
+def combine_years(yearly_dfs, codes_df, microdata_df=None, allow_unmatched=False):
+    """Stick the cleaned years together in one big dataframe and finish it off.
+
+    Parameters
+    ----------
+    yearly_dfs : list
+        Cleaned per-year dataframes, in year order
+    codes_df : pandas.DataFrame
+        `country`, `country_code` lookup
+    microdata_df : pandas.DataFrame, optional
+        Country-year rows aggregated from respondent-level files. These replace
+        rows for the same country and year from `yearly_dfs`, see `merge_microdata`
+    allow_unmatched : bool
+        Leave out countries without a country code, rather than raising
+
+    Returns
+    -------
+    pandas.DataFrame
+        The summary dataset
+
+    Raises
+    ------
+    UnmatchedCountries
+        If a country has no code and isn't in `NO_COUNTRY_CODE`, unless `allow_unmatched`
+    """
+    summary_df = pd.concat(yearly_dfs, axis=0)
+    summary_df["country"] = fix_country_names(summary_df.country)
+    if microdata_df is not None:
+        summary_df = merge_microdata(summary_df, microdata_df)
+
+    # Fix region missing in some years. Drop the column then rejoin a lookup table onto full dataframe.
+    # Countries only listed in years without regions (e.g. Gambia) are kept, without one
+    region_lookup = summary_df.loc[:, ["country", "region"]].drop_duplicates().dropna()
+    summary_df = summary_df.drop(columns=["region"])
+    summary_df = pd.merge(summary_df, region_lookup, on="country", how="left")
+
+    # Keep each country's rows together, in order of first appearance
+    first_seen = {c: i for i, c in enumerate(pd.unique(summary_df.country))}
+    summary_df = summary_df.sort_values(
+        by="country", key=lambda c: c.map(first_seen), kind="stable"
+    )
+
+    # Join on country codes, Plotly can use this to plot country boundaries....
+    # Countries without a code can't be placed on the map, so they're left out
+    summary_df = pd.merge(summary_df, codes_df, on="country", how="left")
+    missing = summary_df.country[summary_df.country_code.isna()].unique()
+    unmatched = sorted(set(missing) - set(NO_COUNTRY_CODE))
+    if unmatched and not allow_unmatched:
+        raise UnmatchedCountries(
+            f"No country code for: {', '.join(unmatched)}. Add them to "
+            "COUNTRY_ALIASES, COUNTRY_NAME_FIXES or EXTRA_COUNTRY_CODES, or pass "
+            "--allow-unmatched to leave them out"
+        )
+    if len(missing):
+        print(f"Leaving out countries without a code: {', '.join(sorted(missing))}")
+    return summary_df.dropna(subset=["country_code"])
+
+
+def write_feather(summary_df, path):
+    """
+    Write a typed columnar copy of `summary_df` for the app to memory-map.
+    Text columns become categoricals, features float32, and rows are sorted by country
+    so the app can use the file as is. Uncompressed so it can be mapped without decoding.
+    """
+    import pyarrow as pa
+    import pyarrow.feather
+
+    summary_df = summary_df.sort_values(by="country", kind="stable")
+    columns = {}
+    for col in summary_df.columns:
+        values = summary_df[col]
+        if col in ["country", "region", "country_code"]:
+            columns[col] = pa.array(values.astype("category"))
+        elif col in ["happiness_rank", "year"]:
+            columns[col] = pa.array(values.to_numpy(dtype=np.int16))
+        else:
+            # Build from numpy so NaN stays a float value rather than becoming null,
+            # which keeps the column zero-copy when mapped
+            columns[col] = pa.array(values.to_numpy(dtype=np.float32))
+
+    pyarrow.feather.write_feather(pa.table(columns), path, compression="uncompressed")
+
+
+def build_microdata(paths, cache_dir=INTERIM_DIR):
+    """Run the respondent-level aggregation stage, cached under a hash of the input files.
+
+    Returns
+    -------
+    tuple
+        (stage hash, aggregated country-year dataframe)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    microdata_hash = stage_hash("microdata", [file_hash(p) for p in paths])
+    cache_path = os.path.join(cache_dir, f"microdata_{microdata_hash}.pkl")
+
+    if os.path.exists(cache_path):
+        return microdata_hash, pd.read_pickle(cache_path)
+
+    print(f"Aggregating microdata: {', '.join(paths)}")
+    microdata_df = summarize_microdata(paths)
+    microdata_df.to_pickle(cache_path)
+    return microdata_hash, microdata_df
+
+
+def build_dataset(
+    years=None,
+    raw_dir=RAW_DIR,
+    output_dir=PROCESSED_DIR,
+    cache_dir=INTERIM_DIR,
+    jobs=None,
+    refresh_country_codes=False,
+    force=False,
+    microdata=None,
+    allow_unmatched=False,
+):
+    """Run the whole pipeline, writing `summary_df.csv` and `summary_df.feather` to `output_dir`.
+
+    Outputs are left alone when none of their inputs changed since the last build,
+    unless `force` is set. `microdata` lists respondent-level csv's to stream into
+    country-year rows (see `microdata.py`), adding weighted means and confidence intervals.
+    Countries without a country code stop the build unless `allow_unmatched` is set,
+    see `combine_years`.
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        The summary dataset, or `None` if the outputs were already up to date
+    """
+    if years is None:
+        years = [
+            y
+            for y in sorted(YEAR_SCHEMAS)
+            if os.path.exists(os.path.join(raw_dir, y + ".csv"))
+        ]
+
+    yearly = build_years(years, raw_dir, cache_dir, jobs)
+    codes_df = load_country_codes(refresh_country_codes)
+
+    microdata_hash, microdata_df = (
+        build_microdata(microdata, cache_dir) if microdata else (None, None)
+    )
+
+    # Everything `combine_years` reads, so editing any of it rebuilds the outputs
+    summary_hash = stage_hash(
+        "summary",
+        [yearly[y][0] for y in years],
+        file_hash(COUNTRY_CODES_FILE),
+        COUNTRY_ALIASES,
+        COUNTRY_NAME_FIXES,
+        EXTRA_COUNTRY_CODES,
+        NO_COUNTRY_CODE,
+        microdata_hash,
+        allow_unmatched,
+    )
+    manifest_path = os.path.join(output_dir, ".build_manifest.json")
+    outputs = [
+        os.path.join(output_dir, "summary_df.csv"),
+        os.path.join(output_dir, "summary_df.feather"),
+    ]
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("summary") == summary_hash and all(
+            os.path.exists(p) for p in outputs
+        ):
+            print("Outputs are up to date")
+            return None
+
+    summary_df = combine_years(
+        [yearly[y][1] for y in years], codes_df, microdata_df, allow_unmatched
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    # Write next to the outputs and rename into place, so a running app reloading
+    # the data (see `src/snapshots.py`) never reads, or maps, a half written file
+    summary_df.to_csv(outputs[0] + ".tmp", index=False)
+    write_feather(summary_df, outputs[1] + ".tmp")
+    for path in outputs:
+        os.replace(path + ".tmp", path)
+    with open(manifest_path, "w") as f:
+        json.dump({"summary": summary_hash, "years": years}, f, indent=2)
+
+    return summary_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--years", nargs="+", choices=sorted(YEAR_SCHEMAS), help="Subset of years"
+    )
+    parser.add_argument("--raw-dir", default=RAW_DIR)
+    parser.add_argument("--output-dir", default=PROCESSED_DIR)
+    parser.add_argument("--cache-dir", default=INTERIM_DIR)
+    parser.add_argument("--jobs", type=int, help="Worker processes, default per CPU")
+    parser.add_argument("--refresh-country-codes", action="store_true")
+    parser.add_argument(
+        "--force", action="store_true", help="Rewrite outputs even if up to date"
+    )
+    parser.add_argument(
+        "--microdata", nargs="+", help="Respondent-level csv's to aggregate in"
+    )
+    parser.add_argument(
+        "--allow-unmatched",
+        action="store_true",
+        help="Leave out countries without a country code instead of stopping",
+    )
+    args = parser.parse_args()
+
+    try:
+        build_dataset(
+            years=args.years,
+            raw_dir=args.raw_dir,
+            output_dir=args.output_dir,
+            cache_dir=args.cache_dir,
+            jobs=args.jobs,
+            refresh_country_codes=args.refresh_country_codes,
+            force=args.force,
+            microdata=args.microdata,
+            allow_unmatched=args.allow_unmatched,
+        )
+    except UnmatchedCountries as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Local copies of the map's geometry and precompressed script bundles for the app.
+
+Downloads plotly's world topojson files (see `TOPOJSON_NAMES`) into `data/raw/topojson`
+unless they are already there (run with `--refresh-topojson` to download them
+again), then writes them to `data/geo`, which the app serves instead of fetching
+them from cdn.plot.ly. With `--simplify TOLERANCE` (in degrees) the coarse
+`world_110m.json` the map uses by default is simplified with Douglas-Peucker,
+so browsers parse and draw fewer points. Arcs are simplified individually and
+keep their end points, so neighbouring countries still share their borders.
+
+Then writes brotli and gzip variants of the geo files and of every script bundle
+the app serves from its Python packages (plotly.js included), to `data/geo` and
+`data/static` respectively, so no response has to be compressed on the fly.
+Rerun after upgrading Dash packages; stale variants are ignored by the app.
+
+Usage (from the repo root):
+    python scripts/build_static_assets.py [--simplify 0.1] [--refresh-topojson]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import urllib.request
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOPOJSON_RAW_DIR = os.path.join(ROOT, "data", "raw", "topojson")
+GEO_DIR = os.path.join(ROOT, "data", "geo")
+STATIC_DIR = os.path.join(ROOT, "data", "static")
+
+TOPOJSON_URL = "https://cdn.plot.ly/"
+# Topojson files plotly.js requests for the world scope, at 1:110m and 1:50m
+TOPOJSON_NAMES = ["world_110m", "world_50m"]
+# The map's default resolution, which `--simplify` applies to
+COARSE_TOPOJSON = "world_110m"
+
+
+def load_topojson(name, refresh=False):
+    """Topojson file `name` from the vendored copy, downloading it first if needed"""
+    path = os.path.join(TOPOJSON_RAW_DIR, name + ".json")
+    if refresh or not os.path.exists(path):
+        os.makedirs(TOPOJSON_RAW_DIR, exist_ok=True)
+        with urllib.request.urlopen(TOPOJSON_URL + name + ".json") as response:
+            data = response.read()
+        with open(path, "wb") as f:
+            f.write(data)
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def douglas_peucker(points, tolerance):
+    """Mask of the points to keep so the line stays within `tolerance` of `points`.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        (n, 2) coordinates along the line
+    tolerance : float
+        Largest allowed distance of a dropped point from the simplified line
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask, always keeping the first and last points
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, direction = points[first], points[last] - points[first]
+        between = points[first + 1 : last] - start
+        length = np.hypot(*direction)
+        if length == 0:
+            # Closed line: distance to the shared end point
+            distance = np.hypot(between[:, 0], between[:, 1])
+        else:
+            distance = (
+                np.abs(direction[0] * between[:, 1] - direction[1] * between[:, 0])
+                / length
+            )
+        i = int(np.argmax(distance))
+        if distance[i] > tolerance:
+            keep[first + 1 + i] = True
+            stack += [(first, first + 1 + i), (first + 1 + i, last)]
+    return keep
+
+
+def simplify_topology(topology, tolerance):
+    """Copy of `topology` with every arc simplified to within `tolerance`.
+
+    Handles quantized (delta-encoded, with a `transform`) and plain arcs. Closed
+    arcs that would be left with fewer than 4 points, small islands, are kept whole
+    so they don't collapse.
+    """
+    transform = topology.get("transform")
+    arcs = []
+    for arc in topology["arcs"]:
+        positions = np.asarray(arc, dtype=float)
+        if transform is not None:
+            positions = np.cumsum(positions, axis=0)
+            points = positions[:, :2] * transform["scale"] + transform["translate"]
+        else:
+            points = positions[:, :2]
+
+        keep = douglas_peucker(points, tolerance)
+        if np.array_equal(points[0], points[-1]) and keep.sum() < 4:
+            keep[:] = True
+
+        kept = positions[keep]
+        if transform is not None:
+            kept = np.diff(kept, axis=0, prepend=np.zeros((1, kept.shape[1])))
+            arcs.append(kept.astype(int).tolist())
+        else:
+            arcs.append(kept.tolist())
+    return dict(topology, arcs=arcs)
+
+
+def write_compressed(source, variant_base=None):
+    """Write gzip (and brotli, when installed) variants of `source` next to
+    `variant_base` (`source` itself by default)
+    """
+    variant_base = variant_base or source
+    os.makedirs(os.path.dirname(variant_base), exist_ok=True)
+    with open(source, "rb") as f:
+        data = f.read()
+
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    for suffix, compressed in variants.items():
+        with open(variant_base + suffix, "wb") as f:
+            f.write(compressed)
+    return len(data), {suffix: len(c) for suffix, c in variants.items()}
+
+
+def build_geo(simplify=0.0, refresh=False, geo_dir=GEO_DIR):
+    """Write the topojson files, simplified if asked, and their compressed variants"""
+    os.makedirs(geo_dir, exist_ok=True)
+    for name in TOPOJSON_NAMES:
+        topology = load_topojson(name, refresh)
+        if simplify and name == COARSE_TOPOJSON:
+            topology = simplify_topology(topology, simplify)
+
+        path = os.path.join(geo_dir, name + ".json")
+        with open(path, "w") as f:
+            json.dump(topology, f, separators=(",", ":"))
+        size, compressed = write_compressed(path)
+        print(f"{path}: {size} bytes, compressed {compressed}")
+
+
+def build_bundles(static_dir=STATIC_DIR):
+    """Write compressed variants of every script bundle the app serves from its packages"""
+    sys.path.insert(0, ROOT)
+    import src.app as app_module
+
+    app = app_module.app
+    # Dash registers the bundles it serves when it first renders the page
+    app.server.test_client().get(app.config.routes_pathname_prefix)
+    for package, paths in sorted(app.registered_paths.items()):
+        package_dir = os.path.dirname(sys.modules[package].__file__)
+        for path in sorted(paths):
+            if not path.endswith(".js"):
+                continue
+            size, compressed = write_compressed(
+                os.path.join(package_dir, path), os.path.join(static_dir, package, path)
+            )
+            print(f"{package}/{path}: {size} bytes, compressed {compressed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--simplify",
+        type=float,
+        default=0.0,
+        help=f"simplification tolerance for {COARSE_TOPOJSON}, in degrees",
+    )
+    parser.add_argument("--refresh-topojson", action="store_true")
+    parser.add_argument(
+        "--clean", action="store_true", help="remove previous outputs first"
+    )
+    args = parser.parse_args()
+
+    if args.clean:
+        shutil.rmtree(GEO_DIR, ignore_errors=True)
+        shutil.rmtree(STATIC_DIR, ignore_errors=True)
+
+    build_geo(args.simplify, args.refresh_topojson)
+    build_bundles()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Streaming aggregation of respondent-level (Gallup style) survey files into
+country-year rows of the summary schema.
+
+Files are read in fixed-size chunks, and each chunk is reduced to per country-year
+weighted moments (weight sum, squared-weight sum, mean, sum of squared deviations).
+Those moments merge exactly (Chan et al.'s parallel update), so memory is bounded
+by the number of country-years rather than the number of respondents, and a file
+far larger than RAM is reduced in one pass. Partial results from several files or
+processes can be merged the same way.
+
+Usage:
+    python scripts/microdata.py respondents.csv [more.csv ...] --output summary.csv
+"""
+
+import argparse
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+# Summary schema column -> column name in the respondent files.
+# Value columns missing from a file are skipped
+MICRODATA_SCHEMA = {
+    "keys": {"country": "country", "year": "year"},
+    "weight": "weight",
+    "values": {
+        "happiness_score": "happiness_score",
+        "gdp_per_capita": "gdp_per_capita",
+        "family": "family",
+        "health_life_expectancy": "health_life_expectancy",
+        "freedom": "freedom",
+        "perceptions_of_corruption": "perceptions_of_corruption",
+        "generosity": "generosity",
+        "dystopia_residual": "dystopia_residual",
+    },
+}
+
+KEYS = ["country", "year"]
+MOMENTS = ["n", "w", "w2", "mean", "m2"]
+
+
+def chunk_moments(chunk, column):
+    """Weighted moments of `column` per country-year within one chunk.
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        Respondent rows with `country`, `year`, `weight` and `column`
+    column : str
+        Value column to summarize
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by (country, year) with columns `MOMENTS`
+    """
+    valid = chunk[column].notna() & chunk.weight.notna() & (chunk.weight > 0)
+    df = chunk.loc[valid, KEYS + ["weight", column]]
+    df = df.assign(wx=df.weight * df[column], w2=df.weight**2)
+
+    groups = df.groupby(KEYS, sort=False)
+    w = groups.weight.transform("sum")
+    # Deviations from each group's own chunk mean, for a numerically stable m2
+    df = df.assign(wd2=df.weight * (df[column] - groups.wx.transform("sum") / w) ** 2)
+
+    sums = df.groupby(KEYS, sort=False).agg(
+        n=("weight", "size"),
+        w=("weight", "sum"),
+        w2=("w2", "sum"),
+        wx=("wx", "sum"),
+        m2=("wd2", "sum"),
+    )
+    sums["mean"] = sums.wx / sums.w
+    return sums.loc[:, MOMENTS]
+
+
+def merge_moments(a, b):
+    """Combine two moment tables over (possibly) different country-years"""
+    index = a.index.union(b.index)
+    a = a.reindex(index, fill_value=0.0)
+    b = b.reindex(index, fill_value=0.0)
+
+    w = a.w + b.w
+    share = (b.w / w).fillna(0.0)
+    delta = b["mean"] - a["mean"]
+
+    return pd.DataFrame(
+        {
+            "n": a.n + b.n,
+            "w": w,
+            "w2": a.w2 + b.w2,
+            "mean": a["mean"] + delta * share,
+            "m2": a.m2 + b.m2 + delta**2 * a.w * share,
+        },
+        index=index,
+    )
+
+
+class StreamingAggregator:
+    """Online, mergeable weighted mean/variance accumulators per country-year.
+
+    Parameters
+    ----------
+    value_columns : list
+        Summary-schema columns to aggregate
+    """
+
+    def __init__(self, value_columns):
+        self.value_columns = list(value_columns)
+        empty = pd.DataFrame(
+            columns=MOMENTS,
+            index=pd.MultiIndex.from_arrays([[], []], names=KEYS),
+            dtype=float,
+        )
+        self.moments = {c: empty for c in self.value_columns}
+
+    def update(self, chunk):
+        """Fold a chunk of respondent rows (already in summary-schema names) in"""
+        if "weight" not in chunk:
+            chunk = chunk.assign(weight=1.0)
+        for column in self.value_columns:
+            self.moments[column] = merge_moments(
+                self.moments[column], chunk_moments(chunk, column)
+            )
+
+    def merge(self, other):
+        """Fold in another aggregator's state, e.g. from a different file or process"""
+        for column in other.value_columns:
+            if column in self.moments:
+                self.moments[column] = merge_moments(
+                    self.moments[column], other.moments[column]
+                )
+            else:
+                self.value_columns.append(column)
+                self.moments[column] = other.moments[column]
+
+    def result(self, confidence=0.95):
+        """Weighted means with normal-approximation confidence intervals.
+
+        The standard error uses Kish's effective sample size `w**2 / w2`, so unequal
+        weights widen the interval.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per country-year with `country`, `year`, and for each value column
+            its weighted mean plus `<column>_ci_lower`, `<column>_ci_upper`
+        """
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        columns = {}
+        for column, m in self.moments.items():
+            n_eff = m.w**2 / m.w2
+            with np.errstate(invalid="ignore", divide="ignore"):
+                variance = (m.m2 / m.w) * n_eff / (n_eff - 1)
+                se = np.sqrt(variance / n_eff)
+            columns[column] = m["mean"]
+            columns[column + "_ci_lower"] = m["mean"] - z * se
+            columns[column + "_ci_upper"] = m["mean"] + z * se
+
+        return pd.DataFrame(columns).reset_index()
+
+
+def aggregate_file(path, schema=MICRODATA_SCHEMA, chunksize=1_000_000):
+    """Stream one respondent-level csv through a `StreamingAggregator`.
+
+    Parameters
+    ----------
+    path : str
+        Respondent-level csv
+    schema : dict
+        Column mapping, see `MICRODATA_SCHEMA`
+    chunksize : int
+        Rows held in memory at once
+
+    Returns
+    -------
+    StreamingAggregator
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    rename = {src: dst for dst, src in schema["keys"].items()}
+    rename.update({src: dst for dst, src in schema["values"].items() if src in header})
+    if schema["weight"] in header:
+        rename[schema["weight"]] = "weight"
+
+    value_columns = [dst for dst, src in schema["values"].items() if src in header]
+    aggregator = StreamingAggregator(value_columns)
+
+    for chunk in pd.read_csv(
+        path,
+        usecols=list(rename),
+        chunksize=chunksize,
+        dtype={schema["keys"]["year"]: str},
+    ):
+        aggregator.update(chunk.rename(columns=rename))
+
+    return aggregator
+
+
+def summarize_microdata(paths, schema=MICRODATA_SCHEMA, chunksize=1_000_000):
+    """Reduce respondent-level files to summary rows, ranked by happiness within each year.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Summary-schema columns present in the files (without `region` / `country_code`,
+        which are joined on when combining with the other years) plus confidence intervals
+    """
+    aggregator = None
+    for path in paths:
+        file_aggregator = aggregate_file(path, schema, chunksize)
+        if aggregator is None:
+            aggregator = file_aggregator
+        else:
+            aggregator.merge(file_aggregator)
+
+    summary_df = aggregator.result()
+    if "happiness_score" in summary_df:
+        summary_df.insert(
+            1,
+            "happiness_rank",
+            summary_df.groupby("year")
+            .happiness_score.rank(ascending=False, method="min")
+            .astype("Int64"),
+        )
+    return summary_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("paths", nargs="+", help="Respondent-level csv files")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--chunksize", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    summarize_microdata(args.paths, chunksize=args.chunksize).to_csv(
+        args.output, index=False
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Prerender the dashboard's most requested figures into its figure cache.
+
+A fresh deploy otherwise builds every figure on first request. This renders:
+
+- the opening view (`DEFAULT_COUNTRIES`, every feature, `DEFAULT_YEARS`), in both tabs
+- the summary bar chart of the opening selection for every year range the slider
+  can produce, as it updates alongside the map while the slider is dragged
+- optionally, the `--top` most frequent input combinations in access logs
+
+The map itself needs no prerendering here: its per-year frames are built with each
+data snapshot, when the app starts.
+
+Figures go into the app's figure cache backend: the SQLite file named by
+`HAPPYDASH_FIGURE_CACHE_DB`, or a directory of JSON files given with
+`--output-dir` (or `HAPPYDASH_FIGURE_CACHE_DIR`). Serve the app with the same
+setting, and the same data, to have them read back. Figures are keyed on the data
+version, so rerun after the data changes.
+
+Access logs are JSON lines, each holding a `_dash-update-component` request body
+(as logged by e.g. nginx with `log_format ... escape=json '$request_body'`). Lines
+that aren't JSON, or lack the figure inputs, are skipped.
+
+Usage (from the repo root):
+    python scripts/prerender.py [--output-dir DIR] [--log access.jsonl ...] [--top 50]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Callback inputs (`id.property`) carrying each part of a view
+VIEW_INPUTS = {
+    "countries": "country-select-1.value",
+    "features": "settled-features.data",
+    "years": "settled-years.data",
+}
+
+
+def logged_views(paths):
+    """Count the views requested in access logs.
+
+    Parameters
+    ----------
+    paths : list
+        JSON lines files of `_dash-update-component` request bodies
+
+    Returns
+    -------
+    collections.Counter
+        Requests per (countries, features, (start, end)) view, each sorted
+    """
+    views = Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    body = json.loads(line)
+                    values = {
+                        f"{spec['id']}.{spec['property']}": spec.get("value")
+                        for spec in body["inputs"]
+                    }
+                    countries, features, years = [
+                        values[VIEW_INPUTS[part]]
+                        for part in ["countries", "features", "years"]
+                    ]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if not countries or not features or not years:
+                    continue
+                views[
+                    (
+                        tuple(sorted(set(countries))),
+                        tuple(sorted(set(features))),
+                        (min(years), max(years)),
+                    )
+                ] += 1
+    return views
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--output-dir",
+        help="write figures as JSON files here, for HAPPYDASH_FIGURE_CACHE_DIR",
+    )
+    parser.add_argument(
+        "--log", nargs="+", default=[], help="access logs of callback request bodies"
+    )
+    parser.add_argument(
+        "--top", type=int, default=50, help="number of logged views to render"
+    )
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.environ["HAPPYDASH_FIGURE_CACHE_DIR"] = os.path.abspath(args.output_dir)
+        os.environ.pop("HAPPYDASH_FIGURE_CACHE_DB", None)
+    if not (
+        os.environ.get("HAPPYDASH_FIGURE_CACHE_DB")
+        or os.environ.get("HAPPYDASH_FIGURE_CACHE_DIR")
+    ):
+        parser.error(
+            "nothing would outlive this process: pass --output-dir or set "
+            "HAPPYDASH_FIGURE_CACHE_DB or HAPPYDASH_FIGURE_CACHE_DIR"
+        )
+
+    sys.path.insert(0, ROOT)
+    import src.app as app_module
+
+    start = time.perf_counter()
+    features = list(app_module.feature_dict.values())
+    years = [int(y) for y in app_module.snapshots.current.engine.years]
+    default = (app_module.DEFAULT_COUNTRIES, features, app_module.DEFAULT_YEARS)
+
+    app_module.prerender([default])
+    ranges = [[lo, hi] for i, lo in enumerate(years) for hi in years[i:]]
+    for year_range in ranges:
+        app_module.build_overall_figure(default[0], features, year_range)
+
+    views = logged_views(args.log).most_common(args.top)
+    app_module.prerender(
+        (list(countries), list(feats), list(year_range))
+        for (countries, feats, year_range), _ in views
+    )
+
+    print(
+        f"Prerendered the opening view, {len(ranges)} year ranges and "
+        f"{len(views)} logged views for data version "
+        f"{app_module.snapshots.current.version} in "
+        f"{time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
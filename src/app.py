@@ -1,18 +1,56 @@
 # Author: Kevin Shahnazari, Dustin Andrews
 # Date created: Jan 18 2021
 
+import os
+import sys
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import dash_bootstrap_components as dbc
-import pandas as pd
 import plotly.graph_objects as go
 import plotly_express as px
-from datetime import datetime
+from types import SimpleNamespace
+
+# Sibling modules are imported by name so the app runs both as `src.app` (gunicorn) and `python src/app.py`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from background import coalesce, drop_if_stale, install_session_cookie, jobs
+from browser_data import detail_dataset
+from data_api import install_data_api
+from dataset import data_files, load_summary_df
+from figure_builders import facet_grid
+from figure_cache import (
+    DirectoryFigureStore,
+    FigureCache,
+    SQLiteFigureStore,
+    figure_key,
+    normalize,
+)
+from http_cache import install_http_cache
+from instrumentation import init_app, instrument, metrics, stage
+from map_frames import ChoroplethFrames
+from query_engine import QueryEngine, RangeAggregates
+from selection import Selections
+from serialization import FastJSONDash, configure_compression
+from snapshots import SnapshotManager
+from static_assets import install_static_assets
 
 ###********************************* Define constants *******************************************
-summary_df = pd.read_csv("data/processed/summary_df.csv").sort_values(by="country")
+# Rendered figures keyed on normalized inputs + data version.
+# Set HAPPYDASH_FIGURE_CACHE_DB to a file path to share hits between gunicorn workers,
+# or HAPPYDASH_FIGURE_CACHE_DIR to a directory of prerendered figures
+if os.environ.get("HAPPYDASH_FIGURE_CACHE_DB"):
+    figure_store = SQLiteFigureStore(os.environ["HAPPYDASH_FIGURE_CACHE_DB"])
+elif os.environ.get("HAPPYDASH_FIGURE_CACHE_DIR"):
+    figure_store = DirectoryFigureStore(os.environ["HAPPYDASH_FIGURE_CACHE_DIR"])
+else:
+    figure_store = None
+
+figure_cache = FigureCache(
+    max_bytes=int(os.environ.get("HAPPYDASH_FIGURE_CACHE_MB", 64)) * 1024 * 1024,
+    backend=figure_store,
+)
 
 SIDEBAR_STYLE = {
     "position": "fixed",
@@ -41,8 +79,28 @@ feature_dict = {
     "Dystopia baseline + residual": "dystopia_residual",
 }
 
+# Display name of each feature column, for legends and facet titles
+feature_labels = {v: k for k, v in feature_dict.items()}
+
 discrete_color_scheme = px.colors.qualitative.Pastel
 
+# Milliseconds the year slider and feature checklist must stay put before the figures
+# update, so intermediate positions and quick toggles don't each cost a render
+DEBOUNCE_MS = int(os.environ.get("HAPPYDASH_DEBOUNCE_MS", 250))
+
+# Build the detail figures in the browser from a copy of the dataset shipped once per
+# data version, instead of on the server for every input change
+CLIENTSIDE_DETAIL = os.environ.get("HAPPYDASH_CLIENTSIDE_DETAIL") == "1"
+
+# Facet grid of the detail view's feature figure
+FEATURE_GRID = dict(
+    wrap=2, col_spacing=0.04, row_spacing=0.07, x_title="year", y_title="Contribution"
+)
+
+# Selection the dashboard opens with
+DEFAULT_COUNTRIES = ["Canada", "Switzerland", "China"]
+DEFAULT_YEARS = [2015, 2019]
+
 ###***************************************Layout building************************************
 
 collapse = html.Div(
@@ -63,84 +121,101 @@ collapse = html.Div(
 )
 
 
-sidebar = dbc.Col(
-    children=[
-        html.H1("World Happiness Report Explorer", className="display-5"),
-        html.Hr(),
-        dbc.Collapse(
-            html.P(
-                """
+def build_sidebar(summary_df):
+    """Sidebar controls, offering the countries and years in `summary_df`"""
+    return dbc.Col(
+        children=[
+            html.H1("World Happiness Report Explorer", className="display-5"),
+            html.Hr(),
+            dbc.Collapse(
+                html.P(
+                    """
                         This dashboard helps you find the overall happiness of all the 
                         different countries globally and the details of the contributing factors to their happiness score.""",
-                style={"color": "black", "width": "100%"},
+                    style={"color": "black", "width": "100%"},
+                ),
+                id="collapse",
             ),
-            id="collapse",
-        ),
-        dbc.Col([collapse]),
-        html.Hr(),
-        html.H2("Features", className="display-6"),
-        html.Hr(),
-        dbc.Checklist(
-            id="feature-select-1",
-            options=[{"label": k, "value": v} for k, v in feature_dict.items()],
-            value=[v for k, v in feature_dict.items()],
-        ),
-        html.Hr(),
-        html.H3("Year Range", className="display-6"),
-        dcc.RangeSlider(
-            id="year-select-1",
-            min=min(summary_df.year),
-            max=max(summary_df.year),
-            step=1,
-            marks={
-                int(x): {"label": str(x), "style": {"transform": "rotate(45deg)"}}
-                for x in list(summary_df.year.unique())
-            },
-            value=[2015, 2019],
-            pushable=1,
-        ),
-        html.Hr(),
-        html.H3(
-            "Countries",
-            className="display-6",
-            style={"width": "50%", "display": "inline-block"},
-        ),
-        dbc.Button(
-            "?",
-            id="country-help",
-            color="info",
-            outline=True,
-            size="sm",
-            style={"float": "right"},
-        ),
-        dbc.Col(
-            dcc.Dropdown(
-                id="country-select-1",
-                multi=True,
-                options=[{"label": x, "value": x} for x in summary_df.country.unique()],
-                value=["Canada", "Switzerland", "China"],
+            dbc.Col([collapse]),
+            html.Hr(),
+            html.H2("Features", className="display-6"),
+            html.Hr(),
+            dbc.Checklist(
+                id="feature-select-1",
+                options=[{"label": k, "value": v} for k, v in feature_dict.items()],
+                value=[v for k, v in feature_dict.items()],
             ),
-            width=12,
-            style={
-                "padding": "10px 10px 10px 0px",
-            },
-        ),
-        # Add a help box for showing how to select countries
-        dbc.Popover(
-            [
-                dbc.PopoverHeader("Country Selection"),
-                dbc.PopoverBody(
-                    "Select countries to evaluate here, or you can click on them on the map"
+            html.Hr(),
+            html.H3("Year Range", className="display-6"),
+            dcc.RangeSlider(
+                id="year-select-1",
+                min=min(summary_df.year),
+                max=max(summary_df.year),
+                step=1,
+                marks={
+                    int(x): {"label": str(x), "style": {"transform": "rotate(45deg)"}}
+                    for x in list(summary_df.year.unique())
+                },
+                value=DEFAULT_YEARS,
+                pushable=1,
+            ),
+            # Checklist and slider values once settled, which the figure callbacks listen to
+            dcc.Store(id="settled-features", data=[v for k, v in feature_dict.items()]),
+            dcc.Store(id="settled-years", data=DEFAULT_YEARS),
+            dcc.Interval(id="input-debounce", interval=DEBOUNCE_MS, disabled=True),
+            html.Hr(),
+            html.H3(
+                "Countries",
+                className="display-6",
+                style={"width": "50%", "display": "inline-block"},
+            ),
+            dbc.Button(
+                "?",
+                id="country-help",
+                color="info",
+                outline=True,
+                size="sm",
+                style={"float": "right"},
+            ),
+            dbc.Col(
+                dcc.Dropdown(
+                    id="country-select-1",
+                    multi=True,
+                    options=[
+                        {"label": x, "value": x} for x in summary_df.country.unique()
+                    ],
+                    value=DEFAULT_COUNTRIES,
                 ),
-            ],
-            id="popover",
-            is_open=False,
-            target="country-help",
-        ),
-    ],
-    style={"background-color": "#f8f9fa"},
-    md=3,
-)
+                width=12,
+                style={
+                    "padding": "10px 10px 10px 0px",
+                },
+            ),
+            # Add a help box for showing how to select countries
+            dbc.Popover(
+                [
+                    dbc.PopoverHeader("Country Selection"),
+                    dbc.PopoverBody(
+                        "Select countries to evaluate here, or you can click on them on the map"
+                    ),
+                ],
+                id="popover",
+                is_open=False,
+                target="country-help",
+            ),
+            # ISO code -> country name lookup for the clientside map click callback
+            dcc.Store(
+                id="country-names",
+                data=summary_df.dropna(subset=["country_code"])
+                .drop_duplicates("country_code")
+                .set_index("country_code")
+                .country.to_dict(),
+            ),
+        ],
+        style={"background-color": "#f8f9fa"},
+        md=3,
+    )
+
 
 ## Build out content within each tab. Sidebar is outside of tab structure
 detail_content = dbc.Col(
@@ -153,120 +228,176 @@ detail_content = dbc.Col(
                 dcc.Graph(id="features-over-time", style={"height": "68vh"}),
             ],
         ),
+        # Server -> browser figure updates, and what the browser has rendered so far
+        dcc.Store(id="detail-figures-update"),
+        dcc.Store(id="detail-rendered"),
+        dcc.Store(id="detail-resync"),
+        # Dataset copy the browser builds detail figures from, with HAPPYDASH_CLIENTSIDE_DETAIL=1
+        dcc.Store(id="detail-data", storage_type="local"),
     ],
 )
 
+# Its `topojsonURL` config is set once the server can serve the map's geometry
+map_graph = dcc.Graph(id="happiness-map", figure={}, style={"height": "50vh"})
+
 summary_content = dbc.Col(
     id="summary_content",
     children=[
         dcc.Loading(
             type="cube",
             children=[
-                dcc.Graph(id="happiness-map", figure={}, style={"height": "50vh"}),
+                map_graph,
                 dcc.Graph(
                     id="happiness-bar-chart", figure={}, style={"height": "45vh"}
                 ),
             ],
         ),
+        # Inputs each summary figure was last rendered from
+        dcc.Store(id="map-rendered"),
+        dcc.Store(id="bar-rendered"),
     ],
 )
 
-app = dash.Dash(
+# Callback responses go through the orjson-based encoder in `serialization.py`
+app = FastJSONDash(
     __name__,
     title="World Happiness Explorer",
     external_stylesheets=[dbc.themes.BOOTSTRAP],
+    compress=False,
 )
 
 server = app.server
+configure_compression(server)
+
+# Session cookie keying in-flight requests and background jobs
+install_session_cookie(server)
+
+# Precompressed script bundles, and the map's topojson from this server rather than
+# plotly's CDN once `scripts/build_static_assets.py` has fetched it
+topojson_url = install_static_assets(app)
+if topojson_url is not None:
+    map_graph.config = {"topojsonURL": topojson_url}
+
+# Server-Timing headers and /metrics, when HAPPYDASH_METRICS=1
+init_app(server)
+for counter in ["hits", "backend_hits", "misses", "evictions", "bytes"]:
+    metrics.gauge(
+        f"happydash_figure_cache_{counter}",
+        f"Figure cache {counter.replace('_', ' ')}",
+        lambda counter=counter: figure_cache.stats()[counter],
+    )
 
-app.layout = dbc.Container(
-    children=[
-        dbc.Row(
-            children=[
-                sidebar,
-                dbc.Col(
-                    children=[
-                        dbc.Tabs(
-                            [
-                                dbc.Tab(
-                                    summary_content,
-                                    label="Summary View",
-                                    tab_id="summary_view",
-                                ),
-                                dbc.Tab(
-                                    detail_content,
-                                    label="Detailed View",
-                                    tab_id="detail_view",
-                                ),
-                            ],
-                            id="tabs",
-                            active_tab="summary_view",
-                        ),
-                    ],
-                    md=7,
-                ),
-            ],
-        ),
-        dbc.Row(
-            children=[
-                dbc.Col(
-                    html.P(
-                        f"""
+
+def build_layout(summary_df):
+    """Page layout listing the countries and years in `summary_df`"""
+    return dbc.Container(
+        children=[
+            dbc.Row(
+                children=[
+                    build_sidebar(summary_df),
+                    dbc.Col(
+                        children=[
+                            dbc.Tabs(
+                                [
+                                    dbc.Tab(
+                                        summary_content,
+                                        label="Summary View",
+                                        tab_id="summary_view",
+                                    ),
+                                    dbc.Tab(
+                                        detail_content,
+                                        label="Detailed View",
+                                        tab_id="detail_view",
+                                    ),
+                                ],
+                                id="tabs",
+                                active_tab="summary_view",
+                            ),
+                        ],
+                        md=7,
+                    ),
+                ],
+            ),
+            dbc.Row(
+                children=[
+                    dbc.Col(
+                        html.P(
+                            """
         This dashboard was made by Dustin, Aidan and Kevin(Khashayar),
         Dashboard last updated 2021-02-06.
-        License is still in effect up to 
-        {datetime.now().date()}         
+        License is still in effect.
         """,
+                        ),
+                        width="auto",
                     ),
-                    width="auto",
-                ),
-                dbc.Col(
-                    html.A(
-                        "    GitHub Repo",
-                        href="https://github.com/UBC-MDS/happy-dash",
-                        target="_blank",
+                    dbc.Col(
+                        html.A(
+                            "    GitHub Repo",
+                            href="https://github.com/UBC-MDS/happy-dash",
+                            target="_blank",
+                        ),
+                        width="auto",
                     ),
-                    width="auto",
-                ),
-            ]
-        ),
-    ],
-    fluid=True,
-    style={"width": "80%"},
-)
+                ]
+            ),
+        ],
+        fluid=True,
+        style={"width": "80%"},
+    )
+
 
 ####*******************************************Callback definition***************************
 def filter_df(summary_df, country_list, feat_list, year_range):
     """
     Helper func to filter summary_df to countries, columns (feat_list), and list of years.
     Keep "country", "happiness_score", "year" for downstream tasks
-    """
-    year_list = list(range(min(year_range), max(year_range) + 1))
 
-    if country_list == []:
-        country_list = summary_df.country.unique().tolist()
+    Lookups go through the current snapshot's prebuilt indexes when `summary_df` is its dataset.
+    """
+    engine = snapshots.current.engine
+    if summary_df is not engine.df:
+        engine = QueryEngine(summary_df)
 
-    return summary_df.loc[
-        ((summary_df.country.isin(country_list)) & (summary_df.year.isin(year_list))),
+    return engine.select(
+        country_list,
         feat_list + ["country", "happiness_score", "year", "country_code"],
-    ]
+        year_range,
+    )
 
 
-@app.callback(
-    [Output("happiness-over-time", "figure"), Output("features-over-time", "figure")],
-    [
-        Input("country-select-1", "value"),
-        Input("feature-select-1", "value"),
-        Input("year-select-1", "value"),
-        Input("tabs", "active_tab"),
-    ],
-)
-def build_detail_plots(country_list, feat_list, year_range, active_tab):
-    """Builds a list of charts summarizing certain countries, feature names (columns in the df)
-    and a time frame.
+def detail_figures_key(country_list, feat_list, year_range):
+    """Figure cache key for `build_detail_figures`"""
+    return figure_key(
+        "build_detail_figures",
+        normalize(country_list),
+        normalize(feat_list),
+        [min(year_range), max(year_range)],
+        snapshots.current.version,
+    )
 
-    First chart returned is happiness score over time.
-    Second chart is a facetted plot for each contributing feature to overall happiness in each country
+
+def overall_figure_key(country_list, feat_list, year_list):
+    """Figure cache key for `build_overall_figure`"""
+    return figure_key(
+        "build_overall_figure",
+        normalize(country_list),
+        normalize(feat_list),
+        [min(year_list), max(year_list)],
+        snapshots.current.version,
+    )
+
+
+@coalesce
+@instrument
+def build_detail_plots(
+    country_list, feat_list, year_range, active_tab, resync, rendered
+):
+    """Builds the update for the detail charts, applied to the graphs by the
+    `apply_detail_update` clientside callback.
+
+    When only the country selection changed since the figures the browser last rendered,
+    only the traces of newly added countries are sent along with the countries to keep.
+    Anything else sends both figures in full.
 
     ** Only executes if "Detailed View" tab is selected **
 
@@ -280,127 +411,267 @@ def build_detail_plots(country_list, feat_list, year_range, active_tab):
         List of years to filter on. Will only contain endpoints
     active_tab : string
         Name of active tab in content area. Used to short circuit callback if detail content isn't active
+    resync : float
+        Set by the browser when an incremental update didn't match its figures, forcing a full update
+    rendered : dict
+        Inputs the browser's detail figures were last rendered from, `None` if there are none
 
     Returns
     -------
-    list : List[plotly.express.Figure]
-        First chart: Happiness score over time by country
-        Second - Eigth chart: Contributing factor trend over time by country.
-        Empty charts appended at end if all features aren't specified.
+    dict
+        `inputs` the update renders, plus either `figures` (both figures in full) or
+        `countries` to keep and `add` (new traces per figure). `dash.no_update` while
+        the detail tab is hidden
     """
-    # Short circuit if detail tab isn't active
+    # Skip the work while the detail tab is hidden, leaving its figures as they are
     if active_tab != "detail_view":
-        return [{}, {}]
-
-    # ALl features to consider
-    all_feats = [v for v in feature_dict.values()]
+        return dash.no_update
 
     if feat_list is None:
-        feat_list = all_feats
+        feat_list = [v for v in feature_dict.values()]
 
-    if country_list == []:
+    if not country_list:
         country_list = ["Canada"]
 
-    # Filter to specified data
-    # Improve year formatting for datetime x-axis
-    filtered_df = (
-        filter_df(summary_df, country_list, feat_list, year_range)
-        .assign(year=lambda x: pd.to_datetime(x.year, format="%Y"))
-        .sort_values(by="year")
+    inputs = {
+        "countries": normalize(country_list),
+        "features": normalize(feat_list),
+        "years": [min(year_range), max(year_range)],
+        "version": snapshots.current.version,
+    }
+
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    # The browser already shows these inputs, e.g. when switching back to the tab
+    if rendered == inputs and "detail-resync.data" not in triggered:
+        return dash.no_update
+
+    incremental = (
+        rendered is not None
+        and "detail-resync.data" not in triggered
+        and {k: v for k, v in rendered.items() if k != "countries"}
+        == {k: v for k, v in inputs.items() if k != "countries"}
+    )
+    if not incremental:
+        return {
+            "inputs": inputs,
+            "figures": build_detail_figures(country_list, feat_list, year_range),
+        }
+
+    # Only ship traces for countries the browser doesn't have yet
+    added = sorted(set(inputs["countries"]) - set(rendered["countries"]))
+    add = [[], []]
+    if added and len(
+        snapshots.current.selections.get(added, feat_list, year_range).frame
+    ):
+        add = [
+            list(fig["data"])
+            for fig in build_detail_figures(added, feat_list, year_range)
+        ]
+
+    return {
+        "inputs": inputs,
+        "base": rendered,
+        "countries": inputs["countries"],
+        "add": add,
+        "palette": discrete_color_scheme,
+    }
+
+
+if CLIENTSIDE_DETAIL:
+    # The browser builds the detail figures itself (`build_detail_update` in
+    # `assets/clientside.js`), so the server only ships it the dataset
+    @app.callback(
+        Output("detail-data", "data"),
+        [Input("detail-data", "modified_timestamp")],
+        [State("detail-data", "data")],
+    )
+    def ship_detail_data(timestamp, stored):
+        """Sends the snapshot's `detail_data` unless the browser's stored copy is of the same data version"""
+        detail_data = snapshots.current.detail_data
+        if stored is not None and stored.get("version") == detail_data["version"]:
+            return dash.no_update
+        return detail_data
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="happydash", function_name="build_detail_update"),
+        Output("detail-figures-update", "data"),
+        [
+            Input("country-select-1", "value"),
+            Input("settled-features", "data"),
+            Input("settled-years", "data"),
+            Input("tabs", "active_tab"),
+            Input("detail-data", "data"),
+        ],
+        [State("detail-rendered", "data")],
     )
-    cols = list(set(all_feats).intersection(filtered_df.columns))
+else:
+    build_detail_plots = app.callback(
+        Output("detail-figures-update", "data"),
+        [
+            Input("country-select-1", "value"),
+            Input("settled-features", "data"),
+            Input("settled-years", "data"),
+            Input("tabs", "active_tab"),
+            Input("detail-resync", "data"),
+        ],
+        [State("detail-rendered", "data")],
+    )(build_detail_plots)
+
+
+@figure_cache.memoize(detail_figures_key)
+@jobs.job
+def build_detail_figures(country_list, feat_list, year_range):
+    """Builds a list of charts summarizing certain countries, feature names (columns in the df)
+    and a time frame.
+
+    First chart returned is happiness score over time.
+    Second chart is a facetted plot for each contributing feature to overall happiness in each country
+
+    Parameters
+    ----------
+    country_list : list
+        List of country names to filter `summary_df` on
+    feat_list : list
+        List of features (column names in `summary_df`)
+    year_range : list
+        List of years to filter on. Will only contain endpoints
+
+    Returns
+    -------
+    list : List[plotly.graph_objects.Figure]
+        First chart: Happiness score over time by country
+        Second - Eigth chart: Contributing factor trend over time by country.
+        Empty charts appended at end if all features aren't specified.
+    """
+    # ALl features to consider
+    all_feats = [v for v in feature_dict.values()]
+
+    # Filter to specified data, with datetime years for the x-axis. Shared with any
+    # other callback working on the same selection
+    selection = snapshots.current.selections.get(country_list, feat_list, year_range)
+    with stage("filter"):
+        filtered_df = selection.frame
+    # Keep facets in `feature_dict` order so every render lays them out the same way
+    cols = [f for f in all_feats if f in filtered_df.columns]
+
+    # One trace per country (and feature), sliced straight out of the column arrays
+    with stage("aggregate"):
+        years, countries, values = selection.traces
+
+    # Stop here if the browser has already asked for newer figures
+    drop_if_stale()
+
+    def line_trace(i, country, rows, n_points, **kwargs):
+        # Like `px`, switch to WebGL once the figure has more than 1000 points
+        if n_points > 1000:
+            trace = go.Scattergl
+        else:
+            trace, kwargs["orientation"] = go.Scatter, "v"
+        return trace(
+            legendgroup=country,
+            line={
+                "color": discrete_color_scheme[i % len(discrete_color_scheme)],
+                "dash": "solid",
+            },
+            marker={"symbol": "circle"},
+            mode="lines+markers",
+            name=country,
+            x=years[rows],
+            **kwargs,
+        )
 
     fig_list = []
 
     # Build first plot - happiness scores over time
-    happiness_plot = (
-        px.line(
-            filtered_df,
-            x="year",
-            y="happiness_score",
-            color="country",
-            color_discrete_sequence=discrete_color_scheme,
-            title="Happiness Score Over Time by Country",
-        )
-        .update_traces(mode="lines+markers")
-        .update_layout(
-            {
+    with stage("figure"):
+        happiness_plot = go.Figure(
+            data=[
+                line_trace(
+                    i,
+                    country,
+                    rows,
+                    len(filtered_df),
+                    hovertemplate=f"country={country}<br>year=%{{x}}<br>happiness_score=%{{y}}<extra></extra>",
+                    showlegend=True,
+                    xaxis="x",
+                    y=values["happiness_score"][rows],
+                    yaxis="y",
+                )
+                for i, (country, rows) in enumerate(countries)
+            ],
+            layout={
+                "legend": (
+                    {"title": {"text": "country"}, "tracegroupgap": 0}
+                    if countries
+                    else {"tracegroupgap": 0}
+                ),
+                "margin": {"b": 0},
+                "title": {"text": "Happiness Score Over Time by Country"},
                 "xaxis": {
+                    "anchor": "y",
+                    "domain": [0.0, 1.0],
                     "tickmode": "array",
                     "tickvals": filtered_df.year.dt.year.unique(),
                     "ticktext": [str(x) for x in filtered_df.year.dt.year.unique()],
+                    "title": {"text": "year"},
                 },
-                "margin": {"b": 0},
-            }
+                "yaxis": {
+                    "anchor": "x",
+                    "domain": [0.0, 1.0],
+                    "title": {"text": "happiness_score"},
+                },
+            },
         )
-    )
     fig_list.append(happiness_plot)
 
-    # Facetted plot for features
-    fig_list.append(
-        px.line(
-            filtered_df.melt(
-                id_vars=["country", "year"], value_vars=cols, value_name="Contribution"
-            ),
-            x="year",
-            y="Contribution",
-            color_discrete_sequence=discrete_color_scheme,
-            color="country",
-            facet_col="variable",
-            facet_col_wrap=2,
-            facet_col_spacing=0.04,
-            facet_row_spacing=0.07,
-            title="Impact Of Features Over Time On Happiness Score",
-        )
-        .for_each_annotation(
-            lambda label: label.update(
-                text=list(feature_dict.keys())[
-                    list(feature_dict.values()).index(label.text.split("=")[1])
-                ]
+    # Facetted plot for features, titled with their display names
+    with stage("figure"):
+        layout, axes = facet_grid([feature_labels[col] for col in cols], **FEATURE_GRID)
+        traces = [
+            line_trace(
+                i,
+                country,
+                rows,
+                len(filtered_df) * len(cols),
+                hovertemplate=f"country={country}<br>variable={col}<br>year=%{{x}}<br>Contribution=%{{y}}<extra></extra>",
+                showlegend=j == 0,
+                xaxis=xaxis,
+                y=values[col][rows],
+                yaxis=yaxis,
             )
+            for i, (country, rows) in enumerate(countries)
+            for j, (col, (xaxis, yaxis)) in enumerate(zip(cols, axes))
+        ]
+        layout["legend"] = (
+            {"title": {"text": "country"}, "tracegroupgap": 0}
+            if traces
+            else {"tracegroupgap": 0}
         )
-        .update_yaxes(matches=None, showticklabels=True)
-        .update_xaxes(showticklabels=True)
-        .update_traces(mode="lines+markers")
-    )
+        layout["title"] = {"text": "Impact Of Features Over Time On Happiness Score"}
+        feature_plot = go.Figure(data=traces, layout=layout)
+        # As in `px`, facet titles take their font from the template
+        for annotation in feature_plot.layout.annotations:
+            annotation.update(font=None)
+    fig_list.append(feature_plot)
 
     return fig_list
 
 
-@app.callback(
-    Output("happiness-map", "figure"),
-    [
-        Input("year-select-1", "value"),
-        Input("tabs", "active_tab"),
-    ],
-)
-def happiness_map(year_range, active_tab):
-    """Builds a cholorpleth map colored by happiness score based on year, time range, country list
-    ** Only executes if "Summary View" tab is selected **
+def build_happiness_map(summary_df):
+    """Builds the animated cholorpleth map colored by happiness score, one frame per year
 
     Parameters
     ----------
-    year_range : list
-        List of years to filter on. Will only contain endpoints
-    active_tab : string
-        Name of active tab in content area. Used to short circuit callback if detail content isn't active
+    summary_df : pandas.DataFrame
+        Rows to plot, all countries and years to animate over
 
     Returns
     -------
     fig : [plotly.express.Figure]
         Chloropleth map with happiness score by country
     """
-
-    # Short circuit if detail tab isn't active
-    if active_tab != "summary_view":
-        return {}
-
-    # Filter to specified data
-    # Leave all countries in
-    filtered_df = filter_df(summary_df, [], [], year_range).sort_values(by="year")
-
     fig = px.choropleth(
-        data_frame=filtered_df,
+        data_frame=summary_df.sort_values(by="year", kind="stable"),
         # locationmode="ISO-3",
         locations="country_code",
         hover_name="country",
@@ -424,18 +695,117 @@ def happiness_map(year_range, active_tab):
     return fig
 
 
+def build_snapshot(summary_df):
+    """Dataset plus everything the callbacks derive from it, built once per data version
+
+    Parameters
+    ----------
+    summary_df : pandas.DataFrame
+        Dataset, as returned by `load_summary_df`
+
+    Returns
+    -------
+    types.SimpleNamespace
+        `df`, `engine` (country/year row indexes), `version`, `aggregates` (prefix
+        sums for year-range means), `selections`, `map_frames`, `layout` and
+        `detail_data` (`None` unless `CLIENTSIDE_DETAIL`)
+    """
+    engine = QueryEngine(summary_df)
+    aggregates = RangeAggregates(
+        engine, list(feature_dict.values()) + ["happiness_score"]
+    )
+    return SimpleNamespace(
+        df=summary_df,
+        engine=engine,
+        version=engine.version,
+        aggregates=aggregates,
+        # Filtered rows, trace arrays and year-range means per distinct input tuple,
+        # computed once and shared by every callback asking for the same selection
+        selections=Selections(engine, aggregates),
+        # Render every year's frame once; requests only reassemble them.
+        # Set HAPPYDASH_MAP_COMPACT=0 to send every frame in full
+        map_frames=ChoroplethFrames(
+            build_happiness_map(summary_df),
+            compact=os.environ.get("HAPPYDASH_MAP_COMPACT", "1") == "1",
+        ),
+        layout=build_layout(summary_df),
+        detail_data=(
+            detail_dataset(
+                engine,
+                list(feature_dict.values()),
+                feature_labels,
+                discrete_color_scheme,
+                FEATURE_GRID,
+            )
+            if CLIENTSIDE_DETAIL
+            else None
+        ),
+    )
+
+
 @app.callback(
-    Output("happiness-bar-chart", "figure"),
+    [Output("happiness-map", "figure"), Output("map-rendered", "data")],
+    [
+        Input("settled-years", "data"),
+        Input("tabs", "active_tab"),
+    ],
+    [State("map-rendered", "data")],
+)
+@coalesce
+@instrument
+def happiness_map(year_range, active_tab, rendered):
+    """Builds a cholorpleth map colored by happiness score based on year, time range, country list
+    ** Only executes if "Summary View" tab is selected and the years changed since the last render **
+
+    Frames come from the snapshot's `map_frames`, prerendered when its data loaded, so no figure is built here.
+
+    Parameters
+    ----------
+    year_range : list
+        List of years to filter on. Will only contain endpoints
+    active_tab : string
+        Name of active tab in content area. Used to short circuit callback if detail content isn't active
+    rendered : dict
+        Inputs the map was last rendered from, `None` if it hasn't been yet
+
+    Returns
+    -------
+    list
+        Chloropleth map with happiness score by country and the inputs it was
+        rendered from, or `dash.no_update` when there's nothing new to show
+    """
+
+    # Skip the work while the summary tab is hidden, leaving its figures as they are
+    if active_tab != "summary_view":
+        return dash.no_update
+
+    # Keep the map already on screen, e.g. when switching back to the tab
+    inputs = {
+        "years": [min(year_range), max(year_range)],
+        "version": snapshots.current.version,
+    }
+    if rendered == inputs:
+        return dash.no_update
+
+    with stage("figure"):
+        return [snapshots.current.map_frames.figure(year_range), inputs]
+
+
+@app.callback(
+    [Output("happiness-bar-chart", "figure"), Output("bar-rendered", "data")],
     [
         Input("country-select-1", "value"),
-        Input("feature-select-1", "value"),
-        Input("year-select-1", "value"),
+        Input("settled-features", "data"),
+        Input("settled-years", "data"),
         Input("tabs", "active_tab"),
     ],
+    [State("bar-rendered", "data")],
 )
-def build_overall_graph(country_list, feat_list, year_list, active_tab):
-    """Builds a bar chart summarizing certain countries, feature names (columns in the df)
-    and a time frame
+@coalesce
+@instrument
+def build_overall_graph(country_list, feat_list, year_list, active_tab, rendered):
+    """Updates the summary bar chart from `build_overall_figure`
+    ** Only executes if "Summary View" tab is selected and the inputs changed since the last render **
 
     Parameters
     ----------
@@ -447,70 +817,112 @@ def build_overall_graph(country_list, feat_list, year_list, active_tab):
         List of years to filter on
     active_tab : string
         Name of active tab in content area. Used to short circuit callback if detail content isn't active
+    rendered : dict
+        Inputs the bar chart was last rendered from, `None` if it hasn't been yet
 
     Returns
     -------
-    fig : plotly.express.Figure
+    list
+        The bar chart and the inputs it was built from, or `dash.no_update` when
+        there's nothing new to show
     """
-    # Short circuit if detail tab isn't active
+    # Skip the work while the summary tab is hidden, leaving its figures as they are
     if active_tab != "summary_view":
-        return {}
+        return dash.no_update
 
     if feat_list is None:
-        feat_list = feature_dict.values
-
-    # Filter to specified data, calculate means
-    filtered_df = (
-        filter_df(summary_df, country_list, feat_list, year_list)
-        .groupby("country")
-        .mean()
-        .reset_index()
-        .sort_values("happiness_score", ascending=True)
-    )
-    cols = list(set(feat_list).intersection(filtered_df.columns))
+        feat_list = list(feature_dict.values())
+
+    # Keep the chart already on screen, e.g. when switching back to the tab
+    inputs = {
+        "countries": normalize(country_list),
+        "features": normalize(feat_list),
+        "years": [min(year_list), max(year_list)],
+        "version": snapshots.current.version,
+    }
+    if rendered == inputs:
+        return dash.no_update
+
+    return [build_overall_figure(country_list, feat_list, year_list), inputs]
+
+
+@figure_cache.memoize(overall_figure_key)
+def build_overall_figure(country_list, feat_list, year_list):
+    """Builds a bar chart summarizing certain countries, feature names (columns in the df)
+    and a time frame
+
+    Parameters
+    ----------
+    country_list : list
+        List of country names to filter `summary_df` on
+    feat_list : list
+        List of features (column names in `summary_df`)
+    year_list : list
+        List of years to filter on
+
+    Returns
+    -------
+    fig : plotly.graph_objects.Figure
+    """
+    # Year-range means per country straight from the precomputed prefix sums
+    with stage("aggregate"):
+        filtered_df = snapshots.current.selections.get(
+            country_list, feat_list, year_list
+        ).means
+    # In the feature selector's order, so traces and their colours are stable
+    cols = [f for f in feature_dict.values() if f in feat_list]
     title_string = (
         f"Average Happiness Score by Contributing Factors: {min(year_list)} to {max(year_list)}"
         if len(year_list) > 1
         else f"Happiness Score by Contributing Factor: {year_list[0]}"
     )
 
-    fig = px.bar(
-        filtered_df,
-        x=cols,
-        y="country",
-        title=title_string,
-        color_discrete_sequence=discrete_color_scheme,
-        labels={
-            "value": "Happiness Score",
-            "country": "Country",
-            "variable": "Features",
-        },
-        orientation="h",
-    )
-
-    ### Code adapted from https://stackoverflow.com/questions/64371174/plotly-how-to-change-variable-label-names-for-the-legend-in-a-plotly-express-li
-    def customLegend(fig, nameSwap):
-        for i, dat in enumerate(fig.data):
-            for elem in dat:
-                if elem == "name":
-                    fig.data[i].name = nameSwap[fig.data[i].name]
-        return fig
-
-    fig = customLegend(
-        fig=fig,
-        nameSwap={
-            "value": "Happiness Score",
-            "country": "Country",
-            "variable": "Features",
-            "gdp_per_capita": "GDP Per Capita",
-            "family": "Family",
-            "health_life_expectancy": "Life Expectancy",
-            "freedom": "Freedom",
-            "perceptions_of_corruption": "Corruption",
-            "generosity": "Generosity",
-            "dystopia_residual": "Dystopia baseline + residual",
-        },
-    )
+    # Stop here if the browser has already asked for a newer chart
+    drop_if_stale()
+
+    # One horizontal bar trace per feature, stacked per country, named for the legend
+    with stage("figure"):
+        countries = filtered_df.country.to_numpy(dtype=object)
+        fig = go.Figure(
+            data=[
+                go.Bar(
+                    hovertemplate=f"Features={col}<br>Happiness Score=%{{x}}<br>Country=%{{y}}<extra></extra>",
+                    legendgroup=col,
+                    marker={
+                        "color": discrete_color_scheme[i % len(discrete_color_scheme)],
+                        "pattern": {"shape": ""},
+                    },
+                    name=feature_labels[col],
+                    orientation="h",
+                    showlegend=True,
+                    textposition="auto",
+                    x=filtered_df[col].to_numpy(dtype="float64"),
+                    xaxis="x",
+                    y=countries,
+                    yaxis="y",
+                )
+                for i, col in enumerate(cols)
+            ],
+            layout={
+                "barmode": "relative",
+                "legend": (
+                    {"title": {"text": "Features"}, "tracegroupgap": 0}
+                    if cols
+                    else {"tracegroupgap": 0}
+                ),
+                "title": {"text": title_string},
+                "xaxis": {
+                    "anchor": "y",
+                    "domain": [0.0, 1.0],
+                    "title": {"text": "Happiness Score"},
+                },
+                "yaxis": {
+                    "anchor": "x",
+                    "domain": [0.0, 1.0],
+                    "title": {"text": "Country"},
+                },
+            },
+        )
 
     ## If wanting to move legend around, update layout
     # fig.update_layout({"legend_orientation": "h", "margin": {"t": 40, "l": 50}})
@@ -518,63 +930,125 @@ def build_overall_graph(country_list, feat_list, year_list, active_tab):
     return fig
 
 
-# Callback to allow clicks on the map to add countries to filter
-@app.callback(
-    Output("country-select-1", "value"),
+# Pass checklist and slider values on to the figure callbacks once they settle
+app.clientside_callback(
+    ClientsideFunction(namespace="happydash", function_name="settle_inputs"),
     [
-        Input("happiness-map", "clickData"),
+        Output("settled-features", "data"),
+        Output("settled-years", "data"),
+        Output("input-debounce", "disabled"),
+    ],
+    [
+        Input("feature-select-1", "value"),
+        Input("year-select-1", "value"),
+        Input("input-debounce", "n_intervals"),
+    ],
+    [
+        State("input-debounce", "interval"),
+        State("settled-features", "data"),
+        State("settled-years", "data"),
     ],
-    [State("country-select-1", "value")],
 )
-def country_click(click_data, current_countries):
-    """Gets click data from happiness map - adds to countries in `country-select-1` drop down box.
-    Uses State to get current countries already in box
 
-    Parameters
-    ----------
-    click_data : dict
-        dictionary corresponding to the points click on `happiness-map`
-    """
-    if click_data is not None:
-        country_code_selected = click_data["points"][0]["location"]
 
-        new_country = summary_df.loc[
-            summary_df.country_code == country_code_selected, "country"
-        ].unique()[0]
+# Apply full or incremental detail figure updates in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="happydash", function_name="apply_detail_update"),
+    [
+        Output("happiness-over-time", "figure"),
+        Output("features-over-time", "figure"),
+        Output("detail-rendered", "data"),
+        Output("detail-resync", "data"),
+    ],
+    [Input("detail-figures-update", "data")],
+    [
+        State("happiness-over-time", "figure"),
+        State("features-over-time", "figure"),
+        State("detail-rendered", "data"),
+    ],
+)
 
-        if current_countries is None:
-            return new_country
-        elif new_country not in set(current_countries):
-            return current_countries + [new_country]
-        else:
-            return current_countries
 
-    else:
-        return current_countries
+# Callback to allow clicks on the map to add countries to filter.
+# UI-only callbacks run in the browser, see `assets/clientside.js`
+app.clientside_callback(
+    ClientsideFunction(namespace="happydash", function_name="country_click"),
+    Output("country-select-1", "value"),
+    [
+        Input("happiness-map", "clickData"),
+    ],
+    [State("country-select-1", "value"), State("country-names", "data")],
+)
 
 
 # Callback for showing help on country selection
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="happydash", function_name="toggle"),
     Output("popover", "is_open"),
     [Input("country-help", "n_clicks")],
     [State("popover", "is_open")],
 )
-def toggle_popover(n, is_open):
-    if n:
-        return not is_open
-    return is_open
 
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="happydash", function_name="toggle"),
     Output("collapse", "is_open"),
     [Input("collapse-button", "n_clicks")],
     [State("collapse", "is_open")],
 )
-def toggle_collapse(n, is_open):
-    if n:
-        return not is_open
-    return is_open
 
 
+# The dataset and everything derived from it, reloaded in the background when the data
+# files change if HAPPYDASH_DATA_RELOAD_SECONDS is set
+snapshots = SnapshotManager(load_summary_df, build_snapshot, data_files())
+snapshots.init_app(server)
+
+# ETags on callback and layout responses, so repeated requests can be answered with a 304
+install_http_cache(
+    server, lambda: snapshots.current.version, app.config.routes_pathname_prefix
+)
+
+# Read-only /api/v1 routes serving the same slices and means as the figures
+install_data_api(server, snapshots, feature_dict.values())
+
+
+def serve_layout():
+    """Layout of the data snapshot serving this request"""
+    return snapshots.current.layout
+
+
+app.layout = serve_layout
+
+
+def prerender(views):
+    """Build the detail and summary figures of each view into `figure_cache`
+
+    Parameters
+    ----------
+    views : iterable
+        (country_list, feat_list, year_range) tuples, as the callbacks receive them
+    """
+    for country_list, feat_list, year_range in views:
+        build_detail_figures(country_list, feat_list, year_range)
+        build_overall_figure(country_list, feat_list, year_range)
+
+
+@snapshots.on_load
+def warm_default_view(snapshot):
+    """Render the figures of the dashboard's opening view for a new data version,
+    so the first visitors after a reload don't pay for them
+    """
+    prerender([(DEFAULT_COUNTRIES, list(feature_dict.values()), DEFAULT_YEARS)])
+
+
+@snapshots.on_swap
+def restart_jobs(snapshot):
+    """Start new pool processes, since the running ones hold the previous data"""
+    jobs.restart()
+
+
+# Fork the background job pool (if enabled) now that every job function is registered
+jobs.start()
+
 if __name__ == "__main__":
     app.run_server(debug=True)
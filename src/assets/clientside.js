@@ -0,0 +1,303 @@
+// Clientside callbacks for UI state (and, with HAPPYDASH_CLIENTSIDE_DETAIL=1, the
+// detail figures), registered in src/app.py with
+// `app.clientside_callback(ClientsideFunction("happydash", ...), ...)`.
+// These run in the browser, so they never make a round trip to the server.
+// Compare two `inputs` records from `build_detail_plots`, ignoring key order
+function same_inputs(a, b) {
+    if (!a || !b) {
+        return a === b;
+    }
+    return ["countries", "features", "years", "version"].every(function (key) {
+        return JSON.stringify(a[key]) === JSON.stringify(b[key]);
+    });
+}
+
+// Distinct values of `values`, sorted like Python's `sorted(set(values))`
+function normalize(values) {
+    return values.filter(function (value, i) {
+        return values.indexOf(value) === i;
+    }).sort();
+}
+
+// One line trace per country, as `line_trace` in `build_detail_figures` draws it
+function line_trace(i, country, n_points, palette, attributes) {
+    var trace = {
+        legendgroup: country,
+        line: {color: palette[i % palette.length], dash: "solid"},
+        marker: {symbol: "circle"},
+        mode: "lines+markers",
+        name: country,
+        type: "scatter",
+    };
+    // Like `px`, switch to WebGL once the figure has more than 1000 points
+    if (n_points > 1000) {
+        trace.type = "scattergl";
+    } else {
+        trace.orientation = "v";
+    }
+    return Object.assign(trace, attributes);
+}
+
+// The two detail figures for `inputs`, built from the `detail_dataset` copy in `data`
+// the same way `build_detail_figures` builds them on the server
+function detail_figures(data, inputs) {
+    var columns = data.columns;
+    var wanted = {};
+    inputs.countries.forEach(function (country) {
+        wanted[country] = true;
+    });
+
+    // Rows are sorted by year, so traces come out in the server's order
+    var names = [];
+    var groups = {};
+    var years = [];
+    for (var row = 0; row < columns.year.length; row++) {
+        var year = columns.year[row];
+        var country = data.countries[columns.country[row]];
+        if (year < inputs.years[0] || year > inputs.years[1] || !wanted[country]) {
+            continue;
+        }
+        if (!groups[country]) {
+            groups[country] = [];
+            names.push(country);
+        }
+        groups[country].push(row);
+        if (years.indexOf(year) === -1) {
+            years.push(year);
+        }
+    }
+    var n_rows = names.reduce(function (n, country) {
+        return n + groups[country].length;
+    }, 0);
+    var cols = data.features.filter(function (col) {
+        return inputs.features.indexOf(col) !== -1;
+    });
+    var pick = function (column, rows) {
+        return rows.map(function (row) {
+            return column[row];
+        });
+    };
+    var dates = function (rows) {
+        return rows.map(function (row) {
+            return columns.year[row] + "-01-01T00:00:00";
+        });
+    };
+    var legend = function (traces) {
+        return traces.length
+            ? {title: {text: "country"}, tracegroupgap: 0}
+            : {tracegroupgap: 0};
+    };
+
+    var happiness_traces = names.map(function (country, i) {
+        return line_trace(i, country, n_rows, data.palette, {
+            hovertemplate: "country=" + country + "<br>year=%{x}<br>happiness_score=%{y}<extra></extra>",
+            showlegend: true,
+            x: dates(groups[country]),
+            xaxis: "x",
+            y: pick(columns.happiness_score, groups[country]),
+            yaxis: "y",
+        });
+    });
+    var happiness_plot = {
+        data: happiness_traces,
+        layout: {
+            legend: legend(happiness_traces),
+            margin: {b: 0},
+            template: data.template,
+            title: {text: "Happiness Score Over Time by Country"},
+            xaxis: {
+                anchor: "y",
+                domain: [0.0, 1.0],
+                tickmode: "array",
+                tickvals: years,
+                ticktext: years.map(String),
+                title: {text: "year"},
+            },
+            yaxis: {anchor: "x", domain: [0.0, 1.0], title: {text: "happiness_score"}},
+        },
+    };
+
+    // Facet grid for this many features, with the facet titles filled in
+    var grid = data.grids[cols.length];
+    var layout = JSON.parse(JSON.stringify(grid.layout));
+    (layout.annotations || []).forEach(function (annotation) {
+        annotation.text = data.labels[cols[Number(annotation.text)]];
+    });
+    var feature_traces = [];
+    names.forEach(function (country, i) {
+        cols.forEach(function (col, j) {
+            feature_traces.push(line_trace(i, country, n_rows * cols.length, data.palette, {
+                hovertemplate: "country=" + country + "<br>variable=" + col + "<br>year=%{x}<br>Contribution=%{y}<extra></extra>",
+                showlegend: j === 0,
+                x: dates(groups[country]),
+                xaxis: grid.axes[j][0],
+                y: pick(columns[col], groups[country]),
+                yaxis: grid.axes[j][1],
+            }));
+        });
+    });
+    layout.legend = legend(feature_traces);
+    layout.template = data.template;
+    layout.title = {text: "Impact Of Features Over Time On Happiness Score"};
+
+    return [happiness_plot, {data: feature_traces, layout: layout}];
+}
+
+// Checklist and slider values waiting to settle: {values: [...], at: timestamp}
+var pending_inputs = null;
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    happydash: {
+        // Add the country clicked on `happiness-map` to `country-select-1`.
+        // `country_names` maps ISO codes to country names and is shipped once in the layout.
+        country_click: function (click_data, current_countries, country_names) {
+            var no_update = window.dash_clientside.no_update;
+            if (!click_data) {
+                return no_update;
+            }
+
+            var new_country = country_names[click_data.points[0].location];
+            if (new_country === undefined) {
+                return no_update;
+            }
+            if (!current_countries) {
+                return [new_country];
+            }
+            if (current_countries.indexOf(new_country) !== -1) {
+                return no_update;
+            }
+            return current_countries.concat([new_country]);
+        },
+
+        // Debounce `feature-select-1` and `year-select-1` into the `settled-*` stores.
+        // Each change restarts the wait; `input-debounce` ticks while values are
+        // pending and passes them on once none arrived for `delay` ms. Only stores
+        // whose value changed are updated, so untouched inputs don't refire callbacks.
+        settle_inputs: function (features, years, n_intervals, delay, settled_features, settled_years) {
+            var no_update = window.dash_clientside.no_update;
+            var triggered = window.dash_clientside.callback_context.triggered.map(function (t) {
+                return t.prop_id;
+            });
+            var from_timer = triggered.length === 1 && triggered[0] === "input-debounce.n_intervals";
+
+            if (!triggered.length) {
+                // Initial call: hand the first values on to the figure callbacks right away
+                return [features, years, true];
+            }
+            if (!from_timer) {
+                pending_inputs = {values: [features, years], at: Date.now()};
+                if (delay > 0) {
+                    return [no_update, no_update, false];
+                }
+            } else if (!pending_inputs) {
+                return [no_update, no_update, true];
+            } else if (Date.now() - pending_inputs.at < delay) {
+                return [no_update, no_update, no_update];
+            }
+
+            var settled = [settled_features, settled_years];
+            var values = pending_inputs.values.map(function (value, i) {
+                return JSON.stringify(value) === JSON.stringify(settled[i]) ? no_update : value;
+            });
+            pending_inputs = null;
+            return values.concat([true]);
+        },
+
+        // Clientside stand-in for `build_detail_plots`: full detail figure updates
+        // built from the `detail-data` store, with the same inputs record and the
+        // same skipping of hidden or already rendered views
+        build_detail_update: function (countries, features, years, active_tab, data, rendered) {
+            var no_update = window.dash_clientside.no_update;
+            if (active_tab !== "detail_view" || !data) {
+                return no_update;
+            }
+
+            var inputs = {
+                countries: normalize(countries && countries.length ? countries : ["Canada"]),
+                features: normalize(features || data.features),
+                years: [Math.min.apply(null, years), Math.max.apply(null, years)],
+                version: data.version,
+            };
+            if (same_inputs(rendered, inputs)) {
+                return no_update;
+            }
+            return {inputs: inputs, figures: detail_figures(data, inputs)};
+        },
+
+        // Apply an update from `build_detail_plots` to the detail graphs.
+        // Full updates replace both figures; incremental ones drop the traces of
+        // deselected countries and append the traces of new ones, so unchanged
+        // countries keep their traces and colors.
+        apply_detail_update: function (update, happiness_fig, features_fig, rendered) {
+            var no_update = window.dash_clientside.no_update;
+            if (!update) {
+                return [no_update, no_update, no_update, no_update];
+            }
+            if (update.figures) {
+                return [update.figures[0], update.figures[1], update.inputs, no_update];
+            }
+
+            var keep = {};
+            update.countries.forEach(function (country) {
+                keep[country] = true;
+            });
+
+            // Colors already in use stay with their countries; new countries take free ones
+            var colors = {};
+            var used = {};
+            [happiness_fig, features_fig].forEach(function (fig) {
+                ((fig && fig.data) || []).forEach(function (trace) {
+                    if (keep[trace.legendgroup] && trace.line) {
+                        colors[trace.legendgroup] = trace.line.color;
+                        used[trace.line.color] = true;
+                    }
+                });
+            });
+            var free = update.palette.filter(function (color) {
+                return !used[color];
+            });
+            var next_color = function (country) {
+                if (!(country in colors)) {
+                    colors[country] = free.length
+                        ? free.shift()
+                        : update.palette[Object.keys(colors).length % update.palette.length];
+                }
+                return colors[country];
+            };
+
+            var figures = [happiness_fig, features_fig].map(function (fig, i) {
+                var data = ((fig && fig.data) || []).filter(function (trace) {
+                    return keep[trace.legendgroup];
+                });
+                var present = {};
+                data.forEach(function (trace) {
+                    present[trace.legendgroup] = true;
+                });
+                update.add[i].forEach(function (trace) {
+                    if (!present[trace.legendgroup]) {
+                        var color = next_color(trace.legendgroup);
+                        data.push(Object.assign({}, trace, {
+                            line: Object.assign({}, trace.line, {color: color}),
+                        }));
+                    }
+                });
+                return Object.assign({}, fig, {data: data});
+            });
+
+            // The update was computed against figures we no longer have: ask for a full one
+            var resync = no_update;
+            if (!same_inputs(rendered, update.base)) {
+                resync = Date.now();
+            }
+            return [figures[0], figures[1], update.inputs, resync];
+        },
+
+        // Flip an `is_open` flag each time its button is clicked
+        toggle: function (n_clicks, is_open) {
+            if (n_clicks) {
+                return !is_open;
+            }
+            return is_open;
+        },
+    },
+});
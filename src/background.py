@@ -0,0 +1,322 @@
+"""
+Per-session request tracking, so work whose result nobody will see can be dropped.
+
+Each browser gets a session cookie (set by `install_session_cookie`). While the
+year slider is dragged or features are toggled, the same output is requested again
+before the previous request is done. Callbacks decorated with `coalesce` register as
+the latest request for their (session, output); an older request still running then
+stops at its next `drop_if_stale` checkpoint, or when its callback returns, and
+answers without an update instead of encoding a response the browser would ignore.
+Tracking is per process, so it covers the requests a gunicorn worker serves.
+
+Heavy figure builders can also run in a local process pool, enabled by setting
+`HAPPYDASH_BACKGROUND_WORKERS` to a number of processes. Functions decorated with
+`jobs.job` then run in the pool instead of the request thread, so a large render
+doesn't hold the gunicorn worker's GIL while its other threads serve fast UI
+callbacks. No broker is involved: the first pool processes are forked from the
+worker as the app finishes loading, while it is still single threaded, sharing its
+data. Later pools (after a data reload, or when a pool process died) are spawned
+instead, since forking a process with running threads can deadlock on locks those
+threads held; spawned processes import the app themselves and so read the current
+data files. Jobs are keyed by session and function; when a newer call arrives for
+the same key, the older job is cancelled if it hasn't started, and the request
+waiting on it returns right away without an update. A job that has already started
+runs to completion, but its result is dropped. When the pool is disabled, outside a
+request, or when a job's pool process dies, decorated functions run inline.
+"""
+
+import importlib
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps
+
+import flask
+from dash.exceptions import PreventUpdate
+from serialization import plain
+
+WORKERS = int(os.environ.get("HAPPYDASH_BACKGROUND_WORKERS") or 0)
+TIMEOUT = float(os.environ.get("HAPPYDASH_BACKGROUND_TIMEOUT", 120))
+
+SESSION_COOKIE = "happydash_session"
+
+# Job functions by name, registered at import so forked pool processes have them too
+_functions = {}
+# Modules defining them, imported by spawned pool processes to register them there
+_modules = set()
+
+
+def _run(name, args):
+    # Runs in a pool process. Figures come back as plain dicts and arrays, which
+    # pickle far faster than `plotly` objects
+    return plain(_functions[name](*args))
+
+
+def _load_modules(modules):
+    # Pool process initializer; the imports are no-ops in forked processes, which
+    # have them already. The app imported by a spawned one mustn't start a pool
+    jobs.workers = 0
+    for module in modules:
+        importlib.import_module(module)
+
+
+def session_id():
+    """Id of the browser session making the current request, `None` without one"""
+    if not flask.has_request_context():
+        return None
+    return flask.request.cookies.get(SESSION_COOKIE)
+
+
+class InFlight:
+    """Latest request per key, e.g. (session, output), in this process.
+
+    A request calls `begin` when it starts; once a newer request for the same key
+    begins, the older one is stale.
+    """
+
+    def __init__(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Register a new latest request for `key` and return its token"""
+        token = object()
+        with self._lock:
+            self._latest[key] = token
+        return token
+
+    def is_stale(self, key, token):
+        """Whether a newer request than `token` has begun for `key`"""
+        return self._latest.get(key) is not token
+
+    def end(self, key, token):
+        """Forget `token`'s request, unless a newer one has replaced it"""
+        with self._lock:
+            if self._latest.get(key) is token:
+                del self._latest[key]
+
+
+in_flight = InFlight()
+
+
+def coalesce(func):
+    """Decorator dropping a callback's result once a newer request from the same
+    session for the same output has arrived, placed under `@app.callback`
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        session = session_id()
+        if session is None:
+            return func(*args, **kwargs)
+
+        key = (session, flask.request.get_json()["output"])
+        token = in_flight.begin(key)
+        flask.g.happydash_in_flight = (key, token)
+        try:
+            result = func(*args, **kwargs)
+            drop_if_stale()
+            return result
+        finally:
+            in_flight.end(key, token)
+
+    return wrapper
+
+
+def drop_if_stale():
+    """Checkpoint for `coalesce`d callbacks between expensive steps.
+
+    Raises
+    ------
+    dash.exceptions.PreventUpdate
+        If a newer request for the current callback's output has arrived
+    """
+    if not flask.has_request_context():
+        return
+    current = flask.g.get("happydash_in_flight")
+    if current is not None and in_flight.is_stale(*current):
+        raise PreventUpdate
+
+
+class _Job:
+    def __init__(self):
+        self.future = None
+        self.superseded = False
+        self.done = threading.Event()
+
+    def supersede(self):
+        self.superseded = True
+        if self.future is not None:
+            self.future.cancel()
+        self.done.set()
+
+
+class BackgroundJobs:
+    """Process pool running the latest job per (session, function).
+
+    Parameters
+    ----------
+    workers : int
+        Pool processes per app process; 0 runs every job inline
+    timeout : float
+        Seconds a request waits for its job before giving up
+    """
+
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._latest = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def start(self):
+        """Fork the pool processes now, while the app process is still single threaded"""
+        # Not while a spawned pool process reruns the parent's main module, which may
+        # import the app before `_load_modules` runs (the check `multiprocessing`
+        # itself makes before starting processes)
+        inheriting = getattr(multiprocessing.current_process(), "_inheriting", False)
+        if self.workers and not inheriting:
+            with self._lock:
+                self._pid = os.getpid()
+                self._pool = self._new_pool("fork")
+
+    def restart(self):
+        """Replace the pool with new processes, e.g. once they hold stale data.
+
+        Safe to call from any thread: the new processes are spawned, and only take over
+        once they have loaded the app. Jobs already running finish in the old processes,
+        on the data their requests were pinned to.
+        """
+        if not self.workers:
+            return
+        pool = self._new_pool("spawn")
+        with self._lock:
+            pool, self._pool = self._pool, pool
+            self._pid = os.getpid()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _new_pool(self, method):
+        """Pool with all its processes started, by the `multiprocessing` start `method`"""
+        pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_load_modules,
+            initargs=(sorted(_modules),),
+        )
+        list(pool.map(int, range(self.workers)))
+        return pool
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                return self._pool
+
+        # Pools don't survive a fork, so each gunicorn worker gets its own. By now the
+        # process may be serving requests on several threads, so it's spawned
+        pool = self._new_pool("spawn")
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool, pool = pool, None
+            current = self._pool
+        if pool is not None:
+            # Another thread's pool got there first
+            pool.shutdown(wait=False)
+        return current
+
+    def _discard(self, pool):
+        """Drop `pool` if it's still the current one, so the next job starts another"""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def run(self, key, name, args):
+        """Run `_functions[name](*args)` in the pool as the latest job for `key`.
+
+        Raises
+        ------
+        dash.exceptions.PreventUpdate
+            If a newer job for `key` arrived before this one finished
+        TimeoutError
+            If the job didn't finish within `timeout` seconds
+
+        A job whose pool process died (`BrokenProcessPool`) is run inline instead.
+        """
+        job = _Job()
+        with self._lock:
+            previous = self._latest.get(key)
+            self._latest[key] = job
+        if previous is not None:
+            previous.supersede()
+
+        if job.superseded:
+            # Superseded itself before it was even submitted
+            raise PreventUpdate
+        pool = self._executor()
+        try:
+            job.future = pool.submit(_run, name, args)
+        except BrokenProcessPool:
+            # A pool process died; start a fresh pool for the next request
+            self._discard(pool)
+            return self._run_inline(key, job, name, args)
+        job.future.add_done_callback(lambda future: job.done.set())
+
+        finished = job.done.wait(self.timeout)
+        with self._lock:
+            if self._latest.get(key) is job:
+                del self._latest[key]
+
+        if job.superseded:
+            raise PreventUpdate
+        if not finished:
+            job.future.cancel()
+            raise TimeoutError(f"{name} still running after {self.timeout:g}s")
+        try:
+            return job.future.result()
+        except BrokenProcessPool:
+            self._discard(pool)
+            return self._run_inline(key, job, name, args)
+
+    def _run_inline(self, key, job, name, args):
+        with self._lock:
+            if self._latest.get(key) is job:
+                del self._latest[key]
+        if job.superseded:
+            raise PreventUpdate
+        return _functions[name](*args)
+
+    def job(self, func):
+        """Decorator running `func` in the pool for requests from a browser session"""
+        name = func.__qualname__
+        _functions[name] = func
+        _modules.add(func.__module__)
+
+        @wraps(func)
+        def wrapper(*args):
+            session = session_id()
+            if not self.workers or session is None:
+                return func(*args)
+            return self.run((session, name), name, args)
+
+        return wrapper
+
+
+jobs = BackgroundJobs()
+
+
+def install_session_cookie(server):
+    """Give each browser a session cookie, so its requests can supersede each other"""
+
+    @server.after_request
+    def _session_cookie(response):
+        if flask.request.cookies.get(SESSION_COOKIE) is None:
+            response.set_cookie(
+                SESSION_COOKIE, uuid.uuid4().hex, httponly=True, samesite="Lax"
+            )
+        return response
@@ -0,0 +1,65 @@
+"""
+Compact copy of the dataset for building the detail figures in the browser.
+
+With `HAPPYDASH_CLIENTSIDE_DETAIL=1` the app ships this once per data version to a
+`dcc.Store` kept in the browser's local storage. The `build_detail_update`
+clientside callback (see `assets/clientside.js`) then filters it and builds the
+detail figures without a server round trip.
+"""
+
+import numpy as np
+import plotly.io as pio
+from figure_builders import facet_grid
+from query_engine import decimal_float64
+
+
+def detail_dataset(engine, features, labels, palette, grid):
+    """Columnar dataset and layout pieces the clientside detail figures are built from.
+
+    Rows are sorted by year (stably), so a filtered subset is already in the order
+    the server-side builder plots it.
+
+    Parameters
+    ----------
+    engine : query_engine.QueryEngine
+        Indexed dataset
+    features : list
+        Feature columns, in facet order
+    labels : dict
+        Display name of each feature
+    palette : list
+        Trace colors
+    grid : dict
+        `facet_grid` options of the feature figure, besides its titles
+
+    Returns
+    -------
+    dict
+        `version`, `countries` (names), `columns` (arrays, `country` as positions
+        in `countries`), `features`, `labels`, `palette`, `template` (the default
+        plotly template every server-built figure carries) and `grids`, the facet
+        grid layout and axes for each number of features, titled "0", "1", ...
+    """
+    df = engine.df
+    order = np.argsort(df.year.to_numpy(), kind="stable")
+    rows = df.iloc[order]
+
+    columns = {"country": engine.country_key[order], "year": rows.year.to_numpy()}
+    for col in ["happiness_score"] + list(features):
+        columns[col] = decimal_float64(rows[col])
+
+    grids = []
+    for n in range(len(features) + 1):
+        layout, axes = facet_grid([str(i) for i in range(n)], **grid)
+        grids.append({"layout": layout, "axes": axes})
+
+    return {
+        "version": engine.version,
+        "countries": list(engine.countries),
+        "columns": columns,
+        "features": list(features),
+        "labels": labels,
+        "palette": list(palette),
+        "template": pio.templates[pio.templates.default].to_plotly_json(),
+        "grids": grids,
+    }
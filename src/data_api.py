@@ -0,0 +1,280 @@
+"""
+Read-only HTTP API over the data behind the dashboard, for other services.
+
+Routes (all `GET`), registered on the Flask server by `install_data_api`:
+
+- `/api/v1/` lists the data version, countries, years and features
+- `/api/v1/rows` returns country/year rows, the slice `filter_df` hands the figures
+- `/api/v1/means` returns per-country means over the year range, as plotted by the
+  summary bar chart
+
+`rows` and `means` take repeated `country` and `feature` parameters (every country
+and feature by default), `start` and `end` years (inclusive, the whole range by
+default), and `limit` and `offset` for pagination. Lookups go through the current
+data snapshot's indexes and shared selections, as the callbacks do.
+
+Results are Arrow IPC streams (`format=arrow`, or `Accept:
+application/vnd.apache.arrow.stream`) or JSON (the default), both written in chunks
+of `CHUNK_ROWS` rows so large results stream out instead of being encoded in one go.
+Responses carry an ETag derived from the data version and the normalized query, so
+clients revalidate with `If-None-Match` and get a `304` until the data changes. A
+page that doesn't reach the end of the result links the next one in a `Link` header.
+"""
+
+import hashlib
+
+import flask
+from figure_cache import normalize
+from query_engine import decimal_floats
+from serialization import to_json
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# Rows encoded per streamed chunk
+CHUNK_ROWS = 1000
+
+# Rows per page unless `limit` asks for fewer (or more, up to `MAX_LIMIT`)
+DEFAULT_LIMIT = 10000
+MAX_LIMIT = 100000
+
+
+class QueryError(ValueError):
+    """Invalid query parameters, answered with a `400`"""
+
+
+class _Sink:
+    # Write-only file collecting what the Arrow stream writer emits
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_chunks(table):
+    """Arrow IPC stream of `table`, yielded a record batch at a time"""
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        yield sink.take()
+        for batch in table.to_batches(CHUNK_ROWS):
+            writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
+
+
+def _json_chunks(df, meta):
+    """JSON object of `meta` plus `columns` and `rows` (lists), yielded in pieces"""
+    head = to_json(dict(meta, columns=list(df.columns)))
+    head = head if isinstance(head, bytes) else head.encode("utf-8")
+    yield head[:-1] + b', "rows": ['
+
+    # Single precision columns (as memory-mapped) by their shortest decimal form,
+    # e.g. 7.404 rather than 7.4039998054504395
+    df = decimal_floats(df)
+    # Missing values as null, which plain `json` would otherwise write as NaN
+    values = df.astype(object).where(df.notna(), None)
+    for start in range(0, len(values), CHUNK_ROWS):
+        chunk = to_json(values.iloc[start : start + CHUNK_ROWS].values.tolist())
+        chunk = chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+        yield (b", " if start else b"") + chunk[1:-1]
+    yield b"]}"
+
+
+class DataAPI:
+    """Query parsing and response encoding for the `/api/v1` routes.
+
+    Parameters
+    ----------
+    snapshots : snapshots.SnapshotManager
+        Source of the current data snapshot, as built by the app's `build_snapshot`
+    features : list
+        Feature columns offered, in output order
+    """
+
+    def __init__(self, snapshots, features):
+        self.snapshots = snapshots
+        self.features = list(features)
+
+    def query(self, args):
+        """Normalized query from request `args`.
+
+        Raises
+        ------
+        QueryError
+            On unknown countries or features, or malformed numbers
+        """
+        engine = self.snapshots.current.engine
+
+        countries = normalize(args.getlist("country"))
+        unknown = [c for c in countries if c not in engine.countries]
+        if unknown:
+            raise QueryError(f"Unknown countries: {', '.join(unknown)}")
+
+        requested = args.getlist("feature")
+        unknown = sorted(set(requested) - set(self.features))
+        if unknown:
+            raise QueryError(f"Unknown features: {', '.join(unknown)}")
+        features = [f for f in self.features if not requested or f in requested]
+
+        try:
+            start = int(args.get("start", engine.years[0]))
+            end = int(args.get("end", engine.years[-1]))
+            limit = int(args.get("limit", DEFAULT_LIMIT))
+            offset = int(args.get("offset", 0))
+        except ValueError:
+            raise QueryError("start, end, limit and offset must be integers")
+        if not 0 < limit <= MAX_LIMIT or offset < 0:
+            raise QueryError(f"limit must be 1 to {MAX_LIMIT}, offset at least 0")
+
+        return {
+            "countries": countries,
+            "features": features,
+            "years": [min(start, end), max(start, end)],
+            "limit": limit,
+            "offset": offset,
+        }
+
+    def etag(self, endpoint, query, fmt):
+        """ETag of a response: changes with the data version or the query"""
+        key = to_json([self.snapshots.current.version, endpoint, query, fmt])
+        key = key if isinstance(key, bytes) else key.encode("utf-8")
+        return hashlib.sha1(key).hexdigest()[:20]
+
+    def rows(self, query):
+        """Rows of the selected countries and years, in dataset order"""
+        return self.snapshots.current.engine.select(
+            query["countries"],
+            ["country", "year", "happiness_score"] + query["features"],
+            query["years"],
+        )
+
+    def means(self, query):
+        """Per-country means, in ascending order of happiness score, at the
+        precision of the rows they average
+        """
+        snapshot = self.snapshots.current
+        means = snapshot.selections.get(
+            query["countries"], query["features"], query["years"]
+        ).means[["country", "happiness_score"] + query["features"]]
+        # Already rounded to the rows' precision; typed like them too, so Arrow
+        # output has the same column types as `rows`
+        dtypes = snapshot.engine.df.dtypes
+        return means.astype(
+            {col: "float32" for col in means.columns[1:] if dtypes[col] == "float32"}
+        )
+
+    def respond(self, endpoint, select):
+        """Response to the current request for `select(query)`, paginated and
+        encoded as the client asked
+        """
+        request = flask.request
+        try:
+            query = self.query(request.args)
+        except QueryError as e:
+            return flask.jsonify(error=str(e)), 400
+
+        fmt = request.args.get("format")
+        if fmt is None:
+            accepted = request.accept_mimetypes.best_match(
+                ["application/json", ARROW_MIMETYPE]
+            )
+            fmt = "arrow" if accepted == ARROW_MIMETYPE else "json"
+        if fmt not in ["json", "arrow"]:
+            return flask.jsonify(error="format must be json or arrow"), 400
+        if fmt == "arrow" and pa is None:
+            return flask.jsonify(error="Arrow output needs pyarrow installed"), 406
+
+        etag = self.etag(endpoint, query, fmt)
+        if request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+        else:
+            response = self._page(select(query), query, fmt)
+        # Weak, so compression doesn't change it; revalidated on every use, since
+        # the data can be reloaded at any time
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept")
+        return response
+
+    def _page(self, df, query, fmt):
+        offset, limit = query["offset"], query["limit"]
+        total = len(df)
+        page = df.iloc[offset : offset + limit].reset_index(drop=True)
+        # Plain strings rather than the memory-mapped dataset's categoricals
+        page = page.assign(country=page.country.astype(str))
+        next_offset = offset + limit if offset + limit < total else None
+
+        if fmt == "arrow":
+            # Converted before the response starts, so a failure is answered with
+            # an error rather than a truncated stream
+            table = pa.Table.from_pandas(page, preserve_index=False)
+            response = flask.Response(_arrow_chunks(table), mimetype=ARROW_MIMETYPE)
+        else:
+            meta = {
+                "version": self.snapshots.current.version,
+                "total": total,
+                "offset": offset,
+                "next_offset": next_offset,
+            }
+            response = flask.Response(
+                _json_chunks(page, meta), mimetype="application/json"
+            )
+
+        response.headers["X-Total-Count"] = str(total)
+        if next_offset is not None:
+            args = flask.request.args.copy()
+            args["offset"] = next_offset
+            next_url = flask.url_for(flask.request.endpoint, **args.to_dict(flat=False))
+            response.headers["Link"] = f'<{next_url}>; rel="next"'
+        return response
+
+
+def install_data_api(server, snapshots, features):
+    """Register the read-only `/api/v1` routes on `server`
+
+    Parameters
+    ----------
+    server : flask.Flask
+    snapshots : snapshots.SnapshotManager
+        Data snapshots the routes read, pinned per request
+    features : list
+        Feature columns offered, in output order
+    """
+    api = DataAPI(snapshots, features)
+
+    @server.route("/api/v1/")
+    def _api_index():
+        snapshot = snapshots.current
+        return flask.jsonify(
+            version=snapshot.version,
+            countries=list(snapshot.engine.countries),
+            years=[int(y) for y in snapshot.engine.years],
+            features=api.features,
+            endpoints=["/api/v1/rows", "/api/v1/means"],
+        )
+
+    @server.route("/api/v1/rows")
+    def _api_rows():
+        return api.respond("rows", api.rows)
+
+    @server.route("/api/v1/means")
+    def _api_means():
+        return api.respond("means", api.means)
+
+    return api
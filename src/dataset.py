@@ -0,0 +1,59 @@
+"""
+Loading of the processed summary dataset written by `scripts/build_dataset.py`.
+
+The typed columnar `summary_df.feather` artifact is memory-mapped when pyarrow is
+available, so gunicorn workers share its pages through the OS page cache instead
+of each holding a privately parsed copy. Otherwise the CSV is parsed as before.
+"""
+
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pa = None
+
+DATA_DIR = os.environ.get("HAPPYDASH_DATA_DIR", "data/processed")
+
+
+def load_summary_df(data_dir=DATA_DIR):
+    """Load `summary_df`, preferring the memory-mapped columnar artifact.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory holding `summary_df.feather` and/or `summary_df.csv`
+
+    Returns
+    -------
+    pandas.DataFrame
+        Summary data sorted by country
+    """
+    feather_path = os.path.join(data_dir, "summary_df.feather")
+    if pa is not None and os.path.exists(feather_path):
+        return read_feather_mmap(feather_path)
+
+    return pd.read_csv(os.path.join(data_dir, "summary_df.csv")).sort_values(
+        by="country"
+    )
+
+
+def data_files(data_dir=DATA_DIR):
+    """Paths `load_summary_df` may read from `data_dir`, whether or not they exist"""
+    return [
+        os.path.join(data_dir, "summary_df.feather"),
+        os.path.join(data_dir, "summary_df.csv"),
+    ]
+
+
+def read_feather_mmap(path):
+    """Read an uncompressed Feather file as a dataframe backed by a memory map.
+
+    Numeric columns without nulls are zero-copy views of the mapped file; the
+    artifact is written already sorted by country so no reordering copy is needed.
+    """
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
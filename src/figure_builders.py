@@ -0,0 +1,113 @@
+"""
+Helpers for building the dashboard's figures with `plotly.graph_objects` directly.
+
+Plotly Express reshapes and validates the whole dataframe on every call, which
+dominates callback time for the small selections the app plots. The builders in
+`app.py` instead slice NumPy column arrays into traces themselves and reproduce
+the layout Plotly Express would have produced, so the figures are unchanged.
+"""
+
+import functools
+import json
+import math
+
+import numpy as np
+import pandas as pd
+import plotly
+from plotly.subplots import make_subplots
+
+
+def group_rows(values):
+    """Distinct `values` in order of first appearance, with the row positions of each.
+
+    Plotly Express orders traces the same way, so a trace per group lines up with
+    what `px` would have drawn.
+
+    Returns
+    -------
+    list : List[Tuple[object, numpy.ndarray]]
+        (value, positions) pairs
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return [(value, np.flatnonzero(codes == i)) for i, value in enumerate(uniques)]
+
+
+@functools.lru_cache(maxsize=None)
+def _facet_grid_json(n_facets, wrap, col_spacing, row_spacing, x_title, y_title):
+    # Same `make_subplots` call and axis updates as `px` with `facet_col_wrap`
+    ncols = min(n_facets, wrap) or 1
+    nrows = math.ceil(n_facets / ncols) or 1
+
+    # `px` lists facets top-left first, while the grid is numbered from the bottom
+    labels = [str(i) for i in range(n_facets)]
+    labels += [None] * (nrows * ncols - n_facets)
+    subplot_titles = [
+        labels[(nrows - 1 - row) * ncols + col]
+        for row in range(nrows)
+        for col in range(ncols)
+    ]
+
+    fig = make_subplots(
+        rows=nrows,
+        cols=ncols,
+        shared_xaxes="all",
+        shared_yaxes="all",
+        subplot_titles=subplot_titles,
+        horizontal_spacing=col_spacing,
+        vertical_spacing=row_spacing,
+        row_heights=[1.0] * nrows,
+        column_widths=[1.0] * ncols,
+        start_cell="bottom-left",
+    )
+    for annotation in fig.layout.annotations:
+        annotation.update(font=None)
+    for row in range(1, nrows + 1):
+        fig.update_yaxes(title_text=y_title, row=row, col=1)
+    for col in range(1, ncols + 1):
+        fig.update_xaxes(title_text=x_title, row=1, col=col)
+    fig.update_yaxes(matches=None, showticklabels=True)
+    fig.update_xaxes(showticklabels=True)
+
+    axes = []
+    for i in range(n_facets):
+        number = (nrows - 1 - i // ncols) * ncols + i % ncols + 1
+        suffix = "" if number == 1 else str(number)
+        axes.append(("x" + suffix, "y" + suffix))
+
+    layout = fig.to_plotly_json()["layout"]
+    layout.pop("template", None)
+    return json.dumps(
+        {"layout": layout, "axes": axes}, cls=plotly.utils.PlotlyJSONEncoder
+    )
+
+
+def facet_grid(titles, wrap, col_spacing, row_spacing, x_title, y_title):
+    """Layout of a wrapped facet grid, laid out as `px(facet_col=..., facet_col_wrap=wrap)` does.
+
+    The grid for each facet count is built once and cached.
+
+    Parameters
+    ----------
+    titles : list
+        Facet titles, in `px` facet order (left to right, then top to bottom)
+    wrap : int
+        Facets per row
+    col_spacing, row_spacing : float
+        Gaps between facets, as fractions of the figure
+    x_title, y_title : str
+        Titles of the bottom row's x-axes and the left column's y-axes
+
+    Returns
+    -------
+    layout : dict
+        Axes and facet title annotations, without template
+    axes : list
+        (xaxis, yaxis) reference of each facet, e.g. ("x7", "y7")
+    """
+    grid = json.loads(
+        _facet_grid_json(len(titles), wrap, col_spacing, row_spacing, x_title, y_title)
+    )
+    layout = grid["layout"]
+    for annotation in layout.get("annotations", []):
+        annotation["text"] = titles[int(annotation["text"])]
+    return layout, [tuple(axis) for axis in grid["axes"]]
@@ -0,0 +1,240 @@
+"""
+Memoization of rendered figures keyed on normalized callback inputs.
+
+Figures are stored as serialized JSON, encoded with the same `to_json` as callback
+responses, so entries have an honest byte size for the LRU budget and can be shared between gunicorn workers through the optional
+SQLite backend, or read from a directory of prerendered figures (see
+`scripts/prerender.py`).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from serialization import to_json
+
+
+def figure_key(name, *parts):
+    """Stable cache key for callback `name` from already-normalized input `parts`"""
+    blob = json.dumps([name, *parts], sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def normalize(values):
+    """Order-insensitive form of a multi-select value. `None` is kept distinct from empty"""
+    return None if values is None else sorted(set(values))
+
+
+class FigureCache:
+    """Bounded in-process LRU of serialized figures, optionally backed by SQLite.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Budget for the serialized figures held in memory. Least recently used
+        entries are evicted once it is exceeded
+    backend : SQLiteFigureStore, optional
+        Shared store consulted on an in-memory miss and written on every build
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, backend=None):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Cached figure for `key` as a plotly JSON dict, or `None`"""
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(blob)
+
+        blob = self.backend.get(key) if self.backend is not None else None
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.backend_hits += 1
+            self._store(key, blob)
+        return json.loads(blob)
+
+    def put(self, key, figure):
+        """Serialize `figure` (a figure or list of figures) and cache it under `key`"""
+        blob = to_json(figure)
+        if isinstance(blob, str):
+            blob = blob.encode("utf-8")
+        with self._lock:
+            self._store(key, blob)
+        if self.backend is not None:
+            self.backend.put(key, blob)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters for hit-rate monitoring"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "backend_hits": self.backend_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def memoize(self, key_func):
+        """Decorator caching a callback's return value under `key_func(*args)`.
+
+        `key_func` returns `None` for calls that shouldn't be cached, e.g. when
+        the callback short circuits for an inactive tab.
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args):
+                key = key_func(*args)
+                if key is None:
+                    return func(*args)
+
+                figure = self.get(key)
+                if figure is None:
+                    figure = func(*args)
+                    self.put(key, figure)
+                return figure
+
+            return wrapper
+
+        return decorator
+
+    def _store(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._entries[key] = blob
+        self._bytes += len(blob)
+
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+
+class SQLiteFigureStore:
+    """Figure store in a SQLite file shared by every worker on the host.
+
+    Parameters
+    ----------
+    path : str
+        Database file, created on first use
+    max_bytes : int
+        Budget for the whole table, enforced by evicting least recently used rows
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute("SELECT value FROM figures WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE figures SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return row[0]
+
+    def put(self, key, blob):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO figures (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            (total,) = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM figures"
+            ).fetchone()
+            if total > self.max_bytes:
+                # Drop the oldest rows until the running total fits the budget again
+                conn.execute(
+                    """
+                    DELETE FROM figures WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS kept
+                            FROM figures
+                        ) WHERE kept > ?
+                    )
+                    """,
+                    (self.max_bytes,),
+                )
+
+    def _connection(self):
+        # Connections can't cross a fork, so reconnect in each gunicorn worker
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS figures (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class DirectoryFigureStore:
+    """Figure store in a directory of `<key>.json` files, e.g. prerendered before a
+    deploy and shipped with it.
+
+    Nothing is evicted; the directory holds whatever was written to it.
+
+    Parameters
+    ----------
+    path : str
+        Directory, created on first write
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, key + ".json"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, blob):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, key + ".json")
+        # Rename into place so concurrent readers never see a partial file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
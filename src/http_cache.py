@@ -0,0 +1,113 @@
+"""
+Conditional requests for Dash's callback and layout responses.
+
+Dash answers the same inputs with the same response for as long as the data and the
+code stay the same, yet every `_dash-update-component` request is computed afresh.
+`install_http_cache` tags these responses, and those of `_dash-layout` and
+`_dash-dependencies`, with a weak ETag. The tag hashes the request (the callback's
+output, inputs, state and triggering props, as canonical JSON), the current data
+version and `code_version()`, which also covers the settings in `RESPONSE_SETTINGS`
+and the map's geometry files. A request whose `If-None-Match` carries the tag gets
+a `304` before any callback runs.
+
+This lets a reverse proxy cache in front of the app (e.g. nginx with
+`proxy_cache_methods POST`, keyed on the request body, and `proxy_cache_revalidate
+on`) answer the default view's callbacks from its cache. Because the data can be
+reloaded, responses are marked `no-cache`, so the proxy revalidates them every time
+but only pays for a `304` while nothing changed.
+
+Responses that set the session cookie aren't tagged, so a shared cache never
+hands one browser's cookie to another.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import dash
+import flask
+import plotly
+from background import SESSION_COOKIE
+from static_assets import geo_version
+
+# Environment settings that change the layout, dependencies or callback responses
+RESPONSE_SETTINGS = [
+    "HAPPYDASH_CLIENTSIDE_DETAIL",
+    "HAPPYDASH_DEBOUNCE_MS",
+    "HAPPYDASH_MAP_COMPACT",
+    "HAPPYDASH_FLOAT_DIGITS",
+    "HAPPYDASH_JSON_ENGINE",
+]
+
+
+def code_version(root=os.path.dirname(os.path.abspath(__file__))):
+    """Short hash of the app's sources and assets under `root`, the Dash and plotly
+    versions, `RESPONSE_SETTINGS` and the served topojson (whose version is in the
+    map's `topojsonURL`), so tags change on every deploy that could change a response
+    """
+    digest = hashlib.sha1(f"{dash.__version__} {plotly.__version__}".encode())
+    settings = {name: os.environ.get(name) for name in RESPONSE_SETTINGS}
+    digest.update(json.dumps([settings, geo_version()], sort_keys=True).encode())
+    for path in sorted(glob.glob(os.path.join(root, "**", "*.*"), recursive=True)):
+        if path.endswith((".py", ".js", ".css")):
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def install_http_cache(server, data_version, prefix="/"):
+    """Answer conditional requests for `server`'s Dash callbacks and layout.
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The Dash app's server
+    data_version : callable
+        Returns the version of the data serving the current request
+    prefix : str
+        The Dash app's `routes_pathname_prefix`
+    """
+    code = code_version()
+    static_paths = [prefix + "_dash-layout", prefix + "_dash-dependencies"]
+    callback_path = prefix + "_dash-update-component"
+
+    def request_tag():
+        request = flask.request
+        if request.method == "GET" and request.path in static_paths:
+            key = request.path
+        elif request.method == "POST" and request.path == callback_path:
+            body = request.get_json(silent=True)
+            if body is None:
+                return None
+            key = json.dumps(body, sort_keys=True, separators=(",", ":"))
+        else:
+            return None
+        digest = hashlib.sha1(f"{code} {data_version()} ".encode())
+        digest.update(key.encode("utf-8"))
+        return digest.hexdigest()[:20]
+
+    @server.before_request
+    def _not_modified():
+        if flask.request.cookies.get(SESSION_COOKIE) is None:
+            return None
+        tag = request_tag()
+        if tag is None:
+            return None
+        flask.g.happydash_etag = tag
+        if flask.request.if_none_match.contains_weak(tag):
+            response = flask.Response(status=304)
+            response.set_etag(tag, weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return None
+
+    @server.after_request
+    def _tag_response(response):
+        tag = flask.g.pop("happydash_etag", None)
+        # Only complete updates: not the 204s of skipped or superseded callbacks
+        if tag is not None and response.status_code == 200:
+            response.set_etag(tag, weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+        return response
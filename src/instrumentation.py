@@ -0,0 +1,195 @@
+"""
+Opt-in per-callback timing, enabled with `HAPPYDASH_METRICS=1`.
+
+Callbacks decorated with `instrument` time their stages with `stage(...)` blocks
+(filtering, aggregation/melt, figure construction). The time from the callback
+returning to the response leaving Flask is recorded as `serialize`, since that is
+where Dash JSON-encodes the figures. Each response carries the timings in a
+`Server-Timing` header, and they are aggregated into histograms served in
+Prometheus text format at `/metrics`.
+
+Histograms live in each worker process and carry a `worker` label, so scrape
+every worker (or run a single one) for complete numbers.
+
+`instrument` also drives the slow-callback profiler in `profiler.py`.
+
+When both are disabled, `instrument` returns the callback unchanged and `stage` is
+a no-op.
+"""
+
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+import flask
+from profiler import ENABLED as PROFILE_ENABLED
+from profiler import THRESHOLD_MS, profiler, write_profile
+
+ENABLED = os.environ.get("HAPPYDASH_METRICS", "") == "1"
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, in the shape Prometheus expects"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound label, cumulative count) pairs, ending with `+Inf`"""
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield str(bound), total
+
+
+class Metrics:
+    """Histograms of callback stage durations keyed by (callback, stage)"""
+
+    def __init__(self):
+        self._histograms = OrderedDict()
+        self._gauges = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, callback, stage_name, seconds):
+        with self._lock:
+            key = (callback, stage_name)
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    def gauge(self, name, help_text, func):
+        """Report `func()` as gauge `name` on every scrape"""
+        self._gauges[name] = (help_text, func)
+
+    def render(self):
+        """Prometheus text exposition of every histogram and gauge"""
+        worker = os.getpid()
+        lines = [
+            "# HELP happydash_callback_stage_seconds Time spent per callback stage",
+            "# TYPE happydash_callback_stage_seconds histogram",
+        ]
+        with self._lock:
+            for (callback, stage_name), hist in self._histograms.items():
+                labels = f'callback="{callback}",stage="{stage_name}",worker="{worker}"'
+                for bound, count in hist.cumulative():
+                    lines.append(
+                        f'happydash_callback_stage_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f"happydash_callback_stage_seconds_sum{{{labels}}} {hist.sum}"
+                )
+                lines.append(
+                    f"happydash_callback_stage_seconds_count{{{labels}}} {hist.count}"
+                )
+
+        for name, (help_text, func) in self._gauges.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f'{name}{{worker="{worker}"}} {func()}')
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def _timed_stage(name, timings):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def _no_stage():
+    yield
+
+
+def stage(name):
+    """Context manager adding the enclosed block's duration to stage `name` of the
+    running callback. No-op outside an instrumented callback or when disabled."""
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        return _no_stage()
+    return _timed_stage(name, timings)
+
+
+def instrument(func):
+    """Decorator timing a Dash callback and its stages, placed under `@app.callback`"""
+    if not (ENABLED or PROFILE_ENABLED):
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = OrderedDict()
+        _local.timings = timings
+        if PROFILE_ENABLED:
+            profiler.start()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.timings = None
+            end = time.perf_counter()
+            timings["total"] = end - start
+
+            if PROFILE_ENABLED:
+                samples = profiler.stop()
+                if timings["total"] * 1000 >= THRESHOLD_MS and samples:
+                    write_profile(func.__name__, timings["total"], samples)
+
+            if ENABLED and flask.has_request_context():
+                flask.g.happydash_timings = (func.__name__, timings, end)
+            elif ENABLED:
+                for name, seconds in timings.items():
+                    metrics.observe(func.__name__, name, seconds)
+
+    return wrapper
+
+
+def init_app(server):
+    """Add the `Server-Timing` header and `/metrics` route to `server` (if enabled)"""
+    if not ENABLED:
+        return
+
+    @server.after_request
+    def _server_timing(response):
+        record = flask.g.pop("happydash_timings", None)
+        if record is None:
+            return response
+
+        callback, timings, end = record
+        timings["serialize"] = time.perf_counter() - end
+        for name, seconds in timings.items():
+            metrics.observe(callback, name, seconds)
+
+        response.headers["Server-Timing"] = ", ".join(
+            [f'callback;desc="{callback}"']
+            + [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+        )
+        return response
+
+    @server.route("/metrics")
+    def _metrics():
+        return flask.Response(
+            metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+        )
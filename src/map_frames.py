@@ -0,0 +1,143 @@
+"""
+Precomputed animation frames for the happiness choropleth.
+
+The map only depends on the selected year range, so the full animated figure is
+rendered once at startup and split into one serialized frame per year. A range
+request then just picks out its frames and slider steps; no Plotly Express call
+happens on the request path.
+
+In compact mode (the default) the per-country attributes that don't change between
+years (`locations`, `hovertext`, `ids`) are sent once, on the figure's trace, and
+each frame only carries that year's `z` vector. plotly.js merges frame data into
+the existing trace when animating, so the map looks the same while the payload
+grows by one float per country and year.
+"""
+
+import base64
+import json
+
+import numpy as np
+import plotly
+
+# Trace attributes that are the same for a country in every frame
+STATIC_ATTRIBUTES = ["locations", "hovertext", "ids"]
+
+
+def _array(value):
+    # Frame values come back from `to_json` either as lists or base64 typed arrays
+    if isinstance(value, dict) and "bdata" in value:
+        return np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+    return np.asarray(value)
+
+
+class ChoroplethFrames:
+    """Per-year frames of an animated choropleth, reassembled for any year range.
+
+    Parameters
+    ----------
+    figure : plotly.graph_objects.Figure
+        Animated figure covering every year, with frames named by year and
+        `animation_group` set so that each location has an id
+    compact : bool
+        Send static per-country attributes once and only `z` per frame
+    """
+
+    def __init__(self, figure, compact=True):
+        figure = json.loads(plotly.io.to_json(figure))
+
+        self.compact = compact
+        self.layout = figure["layout"]
+        self.frames = {int(frame["name"]): frame for frame in figure["frames"]}
+        self.years = sorted(self.frames)
+
+        slider = self.layout["sliders"][0]
+        self.steps = {int(step["label"]): step for step in slider["steps"]}
+
+        # Every country seen in any year, in order of first appearance, with one
+        # row of z values per year (NaN where a country has no data that year)
+        traces = {year: self.frames[year]["data"][0] for year in self.years}
+        positions = {}
+        for trace in traces.values():
+            for country_id in trace["ids"]:
+                positions.setdefault(country_id, len(positions))
+
+        self.static = {
+            attribute: [None] * len(positions) for attribute in STATIC_ATTRIBUTES
+        }
+        z = {year: _array(trace["z"]) for year, trace in traces.items()}
+        # Keep the frames' own float width, so values serialize exactly as before
+        self.z = np.full(
+            (len(self.years), len(positions)),
+            np.nan,
+            dtype=np.result_type(np.float32, *z.values()),
+        )
+        for row, year in enumerate(self.years):
+            trace = traces[year]
+            columns = [positions[country_id] for country_id in trace["ids"]]
+            self.z[row, columns] = z[year]
+            for attribute in STATIC_ATTRIBUTES:
+                for column, value in zip(columns, trace[attribute]):
+                    self.static[attribute][column] = value
+        self.static = {
+            attribute: np.array(values, dtype=object)
+            for attribute, values in self.static.items()
+        }
+
+        # Everything else on the trace, `hovertemplate` included, may differ by year
+        self.trace_attributes = {
+            year: {
+                key: value
+                for key, value in traces[year].items()
+                if key not in STATIC_ATTRIBUTES + ["z"]
+            }
+            for year in self.years
+        }
+
+    def figure(self, year_range):
+        """Figure dict animating over the years within `year_range` (inclusive)"""
+        years = [y for y in self.years if min(year_range) <= y <= max(year_range)]
+
+        layout = dict(self.layout)
+        if len(years) > 1:
+            layout["sliders"] = [
+                dict(self.layout["sliders"][0], steps=[self.steps[y] for y in years])
+            ]
+        else:
+            # Nothing to animate over, so drop the play button and slider
+            layout.pop("sliders", None)
+            layout.pop("updatemenus", None)
+
+        if len(years) > 1 and self.compact:
+            return dict(self._compact(years), layout=layout)
+
+        return {
+            "data": self.frames[years[0]]["data"] if years else [],
+            "frames": [self.frames[y] for y in years] if len(years) > 1 else [],
+            "layout": layout,
+        }
+
+    def _compact(self, years):
+        rows = [self.years.index(y) for y in years]
+        z = self.z[rows]
+        # Only countries with data in at least one of the selected years
+        columns = np.flatnonzero(~np.isnan(z).all(axis=0))
+
+        trace = dict(
+            self.trace_attributes[years[0]],
+            z=z[0, columns],
+            **{attribute: values[columns] for attribute, values in self.static.items()},
+        )
+        frames = [
+            {
+                "data": [
+                    dict(
+                        z=z[i, columns],
+                        hovertemplate=self.trace_attributes[year]["hovertemplate"],
+                    )
+                ],
+                "name": str(year),
+                "traces": [0],
+            }
+            for i, year in enumerate(years)
+        ]
+        return {"data": [trace], "frames": frames}
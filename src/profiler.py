@@ -0,0 +1,138 @@
+"""
+Opt-in sampling profiler for slow callbacks, enabled by setting
+`HAPPYDASH_PROFILE_MS` to a latency threshold in milliseconds.
+
+While an instrumented callback runs, a background thread samples its call stack
+every few milliseconds. Calls slower than the threshold have their samples written
+to `HAPPYDASH_PROFILE_DIR` as a collapsed-stack file (`frame;frame;frame count`
+per line), which flamegraph.pl, speedscope or inferno turn into a flamegraph. Only
+the newest `HAPPYDASH_PROFILE_KEEP` files are kept.
+
+When disabled nothing is sampled and no thread is started.
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+THRESHOLD_MS = float(os.environ.get("HAPPYDASH_PROFILE_MS") or 0)
+ENABLED = THRESHOLD_MS > 0
+PROFILE_DIR = os.environ.get("HAPPYDASH_PROFILE_DIR", "profiles")
+KEEP = int(os.environ.get("HAPPYDASH_PROFILE_KEEP", 50))
+
+# Seconds between stack samples
+INTERVAL = 0.005
+
+# Per-process sequence number keeping profile names unique within a nanosecond
+_sequence = itertools.count()
+
+
+def frame_label(frame):
+    """`function (file:line)`, with site-packages paths shortened to the package"""
+    filename = frame.f_code.co_filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[-1]
+    return f"{frame.f_code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def collapse(frame):
+    """Stack of `frame` as a `;`-separated string, outermost frame first"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from one background thread.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between samples
+    """
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def start(self):
+        """Start sampling the calling thread"""
+        with self._lock:
+            # Threads don't survive a fork, so each gunicorn worker starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._run, name="happydash-profiler", daemon=True
+                ).start()
+            self._active[threading.get_ident()] = Counter()
+        self._wakeup.set()
+
+    def stop(self):
+        """Stop sampling the calling thread and return its {stack: samples} counts"""
+        with self._lock:
+            return self._active.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    # Sleep until the next callback starts
+                    self._wakeup.clear()
+                    continue
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+
+
+profiler = SamplingProfiler()
+
+
+def write_profile(callback, seconds, samples, directory=PROFILE_DIR, keep=KEEP):
+    """Write `samples` as a collapsed-stack file and drop all but the newest `keep`
+
+    Returns
+    -------
+    str
+        Path of the written file
+    """
+    os.makedirs(directory, exist_ok=True)
+    epoch, ns = divmod(time.time_ns(), 1_000_000_000)
+    path = os.path.join(
+        directory,
+        "{}.{:09d}_{}_{}ms_{}-{}.folded".format(
+            time.strftime("%Y%m%dT%H%M%S", time.localtime(epoch)),
+            ns,
+            callback,
+            int(seconds * 1000),
+            os.getpid(),
+            next(_sequence),
+        ),
+    )
+    # "x" refuses to overwrite, should a name ever repeat
+    with open(path, "x") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".folded")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:-keep]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            # Another worker rotated it first
+            pass
+    return path
@@ -0,0 +1,175 @@
+"""
+Intermediate results shared by the figure callbacks.
+
+One input change fires the detail and summary callbacks as separate requests, each
+of which used to slice and reshape the data for itself. A `Selection` holds the
+steps computed from one distinct (countries, features, year range) tuple; each step
+runs at most once, on first use. `Selections` hands the same instance to every
+callback asking for that tuple, whether their requests overlap or arrive one after
+another, so the filtered rows, per-country trace arrays and year-range means are
+each derived once and fanned out to the figures that need them.
+"""
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import pandas as pd
+from figure_builders import group_rows
+from figure_cache import normalize
+from query_engine import decimal_floats
+
+# Columns the detail figures need besides the selected features
+DETAIL_COLUMNS = ["country", "happiness_score", "year", "country_code"]
+
+
+def _step(func):
+    # Like `functools.cached_property`, but computed once per instance even when
+    # several request threads ask for it at the same time
+    name = func.__name__
+
+    @wraps(func)
+    def getter(self):
+        if name not in self._results:
+            with self._lock:
+                if name not in self._results:
+                    self._results[name] = func(self)
+        return self._results[name]
+
+    return property(getter)
+
+
+class Selection:
+    """Lazily computed views of the data for one set of callback inputs.
+
+    Parameters
+    ----------
+    engine : query_engine.QueryEngine
+        Indexed dataset to select from
+    aggregates : query_engine.RangeAggregates
+        Prefix sums for year-range means
+    countries : list
+        Country names, `None` or empty for every country
+    features : list
+        Feature columns
+    year_range : list
+        Year endpoints, inclusive
+    """
+
+    def __init__(self, engine, aggregates, countries, features, year_range):
+        self.engine = engine
+        self.aggregates = aggregates
+        self.countries = countries
+        self.features = features
+        self.year_range = [min(year_range), max(year_range)]
+        self._results = {}
+        self._lock = threading.RLock()
+
+    @_step
+    def frame(self):
+        """Selected rows with `year` as datetimes, sorted by year keeping row order
+        within a year, and float32 columns widened by their shortest decimal form
+        """
+        return (
+            decimal_floats(
+                self.engine.select(
+                    self.countries, self.features + DETAIL_COLUMNS, self.year_range
+                )
+            )
+            .assign(year=lambda x: pd.to_datetime(x.year, format="%Y"))
+            .sort_values(by="year", kind="stable")
+        )
+
+    @_step
+    def traces(self):
+        """Arrays for one trace per country, sliced out of `frame`.
+
+        Returns
+        -------
+        years : numpy.ndarray
+            `year` of every row
+        countries : list
+            (country, row positions) pairs, in order of first appearance
+        values : dict
+            Float64 array per column, for `happiness_score` and the features
+        """
+        frame = self.frame
+        return (
+            frame.year.to_numpy(),
+            group_rows(frame.country),
+            {
+                col: frame[col].to_numpy(dtype="float64")
+                for col in ["happiness_score"] + self.features
+                if col in frame.columns
+            },
+        )
+
+    @_step
+    def means(self):
+        """Mean of each feature and `happiness_score` per country over the year
+        range, in ascending order of happiness score
+        """
+        means = self.aggregates.mean(
+            self.countries, self.features + ["happiness_score"], self.year_range
+        )
+        # No more digits than the float32 rows they average, e.g. 1.0034172 rather
+        # than 1.0034171600000001
+        dtypes = self.engine.df.dtypes
+        means = decimal_floats(
+            means.astype(
+                {
+                    col: "float32"
+                    for col in means.columns[1:]
+                    if dtypes[col] == "float32"
+                }
+            )
+        )
+        return means.sort_values("happiness_score", ascending=True)
+
+
+class Selections:
+    """Bounded LRU of `Selection`s keyed on normalized inputs and data version.
+
+    Parameters
+    ----------
+    engine : query_engine.QueryEngine
+    aggregates : query_engine.RangeAggregates
+    max_entries : int
+        Number of distinct input tuples to keep
+    """
+
+    def __init__(self, engine, aggregates, max_entries=64):
+        self.engine = engine
+        self.aggregates = aggregates
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Drop every shared `Selection`"""
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, country_list, feat_list, year_range):
+        """The shared `Selection` for these callback inputs"""
+        countries = normalize(country_list)
+        features = normalize(feat_list) or []
+        key = (
+            None if countries is None else tuple(countries),
+            tuple(features),
+            min(year_range),
+            max(year_range),
+            self.engine.version,
+        )
+        with self._lock:
+            selection = self._entries.get(key)
+            if selection is None:
+                selection = Selection(
+                    self.engine, self.aggregates, countries, features, year_range
+                )
+                self._entries[key] = selection
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+        return selection
@@ -0,0 +1,231 @@
+"""
+Fast JSON encoding and compression of callback responses.
+
+Dash 1.x encodes every callback response with `json.dumps(..., cls=PlotlyJSONEncoder)`,
+which converts each figure with `to_plotly_json` (a deep copy of every array) and
+then walks the result in pure Python. `FastJSONDash` registers callbacks the same way
+Dash does but encodes their responses with `to_json`, which hands NumPy arrays to
+orjson as they are, optionally rounding floats to `HAPPYDASH_FLOAT_DIGITS` decimals
+on the way.
+
+`configure_compression` sets up gzip (and brotli, when installed) compression of
+responses larger than `HAPPYDASH_COMPRESS_MIN_BYTES`.
+"""
+
+import base64
+import collections
+import json
+import os
+from functools import wraps
+
+import dash
+import numpy as np
+import pandas as pd
+import plotly
+from dash import _validate
+from dash._utils import stringify_id
+from dash.dash import _NoUpdate
+from dash.exceptions import PreventUpdate
+from flask_compress import Compress
+from plotly.basedatatypes import BaseFigure, BasePlotlyType
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+_float_digits = os.environ.get("HAPPYDASH_FLOAT_DIGITS", "")
+FLOAT_DIGITS = int(_float_digits) if _float_digits else None
+COMPRESS_MIN_BYTES = int(os.environ.get("HAPPYDASH_COMPRESS_MIN_BYTES", 1024))
+JSON_ENGINE = os.environ.get(
+    "HAPPYDASH_JSON_ENGINE", "orjson" if orjson is not None else "json"
+)
+
+
+def _typed_array(spec):
+    # Plotly's base64 typed array spec, e.g. {"dtype": "f8", "bdata": "..."}
+    array = np.frombuffer(base64.b64decode(spec["bdata"]), dtype=spec["dtype"])
+    if "shape" in spec:
+        shape = spec["shape"]
+        if isinstance(shape, str):
+            shape = [int(n) for n in shape.split(",")]
+        array = array.reshape(shape)
+    return array
+
+
+def plain(obj, float_digits=None):
+    """`obj` as dicts, lists, scalars and NumPy arrays that orjson encodes natively.
+
+    Figures contribute their trace and layout properties as stored, without the copy
+    `to_plotly_json` makes. Typed arrays (`bdata`) are decoded back into arrays, since
+    the plotly.js bundled with dash-renderer 1.x predates them.
+
+    Parameters
+    ----------
+    obj : object
+        Callback output: figures, dicts, lists, arrays, pandas objects, scalars
+    float_digits : int, optional
+        Round floats to this many decimals
+
+    Returns
+    -------
+    object
+    """
+    if isinstance(obj, dict):
+        if "bdata" in obj and "dtype" in obj:
+            return plain(_typed_array(obj), float_digits)
+        return {key: plain(value, float_digits) for key, value in obj.items()}
+
+    if isinstance(obj, (list, tuple)):
+        return [plain(value, float_digits) for value in obj]
+
+    if isinstance(obj, BaseFigure):
+        figure = {"data": obj._data, "layout": obj._layout}
+        if obj.frames:
+            figure["frames"] = [frame.to_plotly_json() for frame in obj.frames]
+        return plain(figure, float_digits)
+
+    if isinstance(obj, BasePlotlyType):
+        return plain(obj.to_plotly_json(), float_digits)
+
+    if isinstance(obj, (pd.Series, pd.Index)):
+        obj = obj.to_numpy()
+
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == "f":
+            if float_digits is not None:
+                obj = np.round(obj.astype("float64"), float_digits)
+        elif obj.dtype.kind == "O":
+            return plain(obj.tolist(), float_digits)
+        return np.ascontiguousarray(obj)
+
+    if isinstance(obj, (float, np.floating)):
+        return obj if float_digits is None else round(float(obj), float_digits)
+
+    return obj
+
+
+def _default(obj):
+    # Anything orjson doesn't know, e.g. dates or numpy booleans
+    return plotly.utils.PlotlyJSONEncoder().default(obj)
+
+
+def to_json(obj, engine=JSON_ENGINE, float_digits=FLOAT_DIGITS):
+    """Serialize a callback response.
+
+    Parameters
+    ----------
+    obj : object
+        Response to encode
+    engine : str
+        "orjson", or "json" for the standard library encoder
+    float_digits : int, optional
+        Round floats to this many decimals
+
+    Returns
+    -------
+    bytes or str
+    """
+    obj = plain(obj, float_digits)
+    if engine == "orjson":
+        return orjson.dumps(
+            obj,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(obj, cls=plotly.utils.PlotlyJSONEncoder)
+
+
+class FastJSONDash(dash.Dash):
+    """`dash.Dash` encoding callback responses with `serializer` instead of
+    `json.dumps(..., cls=PlotlyJSONEncoder)`.
+
+    Parameters
+    ----------
+    serializer : callable
+        Response dict -> bytes or str. Defaults to `to_json`
+    """
+
+    def __init__(self, *args, serializer=to_json, **kwargs):
+        self.serializer = serializer
+        super().__init__(*args, **kwargs)
+
+    def callback(self, *args, **kwargs):
+        register = super().callback(*args, **kwargs)
+
+        def wrap_func(func):
+            add_context = register(func)
+            for callback_id, spec in self.callback_map.items():
+                if spec.get("callback") is add_context:
+                    spec["callback"] = self._serialized(func, callback_id)
+            return add_context
+
+        return wrap_func
+
+    def _serialized(self, func, callback_id):
+        # Same response handling as Dash's own `add_context`, bar the encoder
+        multi = callback_id.startswith("..")
+
+        @wraps(func)
+        def add_context(*args, **kwargs):
+            output_spec = kwargs.pop("outputs_list")
+            output_value = func(*args, **kwargs)
+
+            if isinstance(output_value, _NoUpdate):
+                raise PreventUpdate
+
+            if not multi:
+                output_value, output_spec = [output_value], [output_spec]
+
+            _validate.validate_multi_return(output_spec, output_value, callback_id)
+
+            component_ids = collections.defaultdict(dict)
+            has_update = False
+            for val, spec in zip(output_value, output_spec):
+                if isinstance(val, _NoUpdate):
+                    continue
+                for vali, speci in (
+                    zip(val, spec) if isinstance(spec, list) else [[val, spec]]
+                ):
+                    if not isinstance(vali, _NoUpdate):
+                        has_update = True
+                        component_ids[stringify_id(speci["id"])][
+                            speci["property"]
+                        ] = vali
+
+            if not has_update:
+                raise PreventUpdate
+
+            try:
+                return self.serializer({"response": component_ids, "multi": True})
+            except TypeError:
+                _validate.fail_callback_output(output_value, callback_id)
+
+        return add_context
+
+
+def configure_compression(server, min_bytes=COMPRESS_MIN_BYTES):
+    """Compress `server`'s responses of at least `min_bytes`, with brotli when available.
+
+    Construct the Dash app with `compress=False`, since Dash would otherwise
+    install gzip-only compression with its own settings.
+    """
+    server.config.update(
+        COMPRESS_ALGORITHM=["br", "gzip"] if brotli is not None else ["gzip"],
+        COMPRESS_MIN_SIZE=min_bytes,
+        # Brotli's default quality (11) costs far more CPU than it saves in bytes
+        COMPRESS_BR_LEVEL=4,
+        COMPRESS_LEVEL=6,
+        COMPRESS_MIMETYPES=[
+            "application/json",
+            "application/javascript",
+            "text/css",
+            "text/html",
+        ],
+    )
+    Compress(server)
@@ -0,0 +1,171 @@
+"""
+Versioned snapshots of the dataset and everything derived from it, reloaded
+without a restart.
+
+A snapshot bundles the dataframe with the structures the callbacks read from it
+(query indexes, prefix sums, prerendered map frames, ...), as built by the app's
+`build` function, plus a `version`: the content hash that figure caches key on.
+Requests read `snapshots.current`, which is pinned for the duration of a request, so
+a request sees one snapshot throughout even when a newer one goes live meanwhile.
+
+With `HAPPYDASH_DATA_RELOAD_SECONDS` set, a thread in each worker checks the data
+files that often. When they change it loads, builds and warms a new snapshot off
+the request path, then swaps it in with a single reference assignment: new requests
+use it right away, requests in flight finish on the old one. Files whose contents
+didn't change (same version) aren't swapped, and a load that fails keeps the current
+snapshot and is retried on the next check.
+
+Publish new data by renaming complete files into place (as `build_dataset.py` does),
+so a reload never reads a partially written file.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+RELOAD_SECONDS = float(os.environ.get("HAPPYDASH_DATA_RELOAD_SECONDS") or 0)
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotManager:
+    """Current data snapshot, replaced in the background when the data files change.
+
+    Parameters
+    ----------
+    load : callable
+        Reads the data files, returning a dataframe
+    build : callable
+        Dataframe -> snapshot, any object with a `version` attribute
+    paths : list
+        Files whose changes trigger a reload
+    interval : float
+        Seconds between checks of `paths`, 0 never reloads
+    """
+
+    def __init__(self, load, build, paths, interval=RELOAD_SECONDS):
+        self.load = load
+        self.build = build
+        self.paths = list(paths)
+        self.interval = interval
+        self._loaders = []
+        self._listeners = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+
+        self._stamp = self._file_stamp()
+        self._latest = build(load())
+
+    @property
+    def current(self):
+        """Snapshot pinned to this thread (e.g. for the current request), else the latest"""
+        pinned = getattr(self._local, "snapshot", None)
+        return pinned if pinned is not None else self._latest
+
+    @contextmanager
+    def pinned(self, snapshot=None):
+        """Make `snapshot` (the latest by default) `current` for this thread"""
+        previous = getattr(self._local, "snapshot", None)
+        self._local.snapshot = snapshot if snapshot is not None else self._latest
+        try:
+            yield self._local.snapshot
+        finally:
+            self._local.snapshot = previous
+
+    def on_load(self, func):
+        """Register `func(snapshot)`, called with each newly built snapshot pinned,
+        before it goes live. Use it to warm caches for the new version.
+        """
+        self._loaders.append(func)
+        return func
+
+    def on_swap(self, func):
+        """Register `func(snapshot)`, called once a new snapshot has gone live"""
+        self._listeners.append(func)
+        return func
+
+    def init_app(self, server):
+        """Pin a snapshot for each of `server`'s requests and watch the data files"""
+
+        @server.before_request
+        def _pin_snapshot():
+            self.start()
+            self._local.snapshot = self._latest
+
+        @server.teardown_request
+        def _unpin_snapshot(exc):
+            self._local.snapshot = None
+
+    def start(self):
+        """Start checking the data files from this process, if reloading is enabled"""
+        if not self.interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, so each gunicorn worker starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._watch, name="happydash-snapshots", daemon=True
+                ).start()
+
+    def reload(self, force=False):
+        """Build and swap in a new snapshot if the data files changed.
+
+        Parameters
+        ----------
+        force : bool
+            Reload even if the files look unchanged
+
+        Returns
+        -------
+        bool
+            Whether a new snapshot went live
+        """
+        stamp = self._file_stamp()
+        if stamp == self._stamp and not force:
+            return False
+
+        df = self.load()
+        if self._file_stamp() != stamp:
+            # Files changed again while loading; wait for them to settle
+            return False
+
+        snapshot = self.build(df)
+        self._stamp = stamp
+        if snapshot.version == self._latest.version:
+            return False
+
+        with self.pinned(snapshot):
+            for func in self._loaders:
+                func(snapshot)
+
+        previous, self._latest = self._latest, snapshot
+        logger.info("Data version %s replaced %s", snapshot.version, previous.version)
+        for func in self._listeners:
+            func(snapshot)
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reload()
+            except Exception:
+                logger.exception(
+                    "Reloading data failed, keeping version %s", self._latest.version
+                )
+
+    def _file_stamp(self):
+        # A replaced file gets a new inode; one rewritten in place a new mtime or size
+        stamp = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stamp.append(None)
+            else:
+                stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return stamp
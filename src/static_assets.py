@@ -0,0 +1,160 @@
+"""
+Local serving of the map's geometry, and precompressed script bundles.
+
+By default plotly.js fetches the choropleth's world topojson from cdn.plot.ly on
+first render, a network hop that stalls or fails where outbound traffic is
+restricted. When `scripts/build_static_assets.py` has put the topojson files in
+`HAPPYDASH_GEO_DIR`, `install_static_assets` serves them from the app under a
+content-hashed URL, cached by browsers for a year, and the map's `topojsonURL`
+config points there.
+
+The script bundles (plotly.js included, as dash-core-components' `async-plotlyjs.js`)
+are already served by Dash itself, fingerprinted and cached for a year. They are
+also compressed on the fly for every browser that doesn't have them yet, several
+megabytes per page load. When the build script has written brotli and gzip
+variants of them to `HAPPYDASH_STATIC_DIR`, those are sent instead. Precompressed
+variants of the topojson files are used the same way. A variant older than its
+source file, e.g. after a package upgrade, is ignored until rebuilt.
+"""
+
+import glob
+import hashlib
+import os
+import sys
+from functools import wraps
+
+import flask
+from dash.fingerprint import check_fingerprint
+
+GEO_DIR = os.environ.get("HAPPYDASH_GEO_DIR", "data/geo")
+STATIC_DIR = os.environ.get("HAPPYDASH_STATIC_DIR", "data/static")
+
+# Precompressed variants by preference, with their file suffixes
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+ONE_YEAR = 31536000
+
+
+def geo_version(geo_dir=GEO_DIR):
+    """Short hash of the topojson files in `geo_dir`, `None` if there are none"""
+    paths = sorted(glob.glob(os.path.join(geo_dir, "*.json")))
+    if not paths:
+        return None
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def precompressed(source, variant_base=None):
+    """Best precompressed variant of `source` the current request accepts.
+
+    Parameters
+    ----------
+    source : str
+        Path of the uncompressed file
+    variant_base : str, optional
+        Path the variants' suffixes are appended to, `source` by default
+
+    Returns
+    -------
+    tuple
+        (encoding, variant path), or `(None, None)` if no usable variant exists
+    """
+    if not os.path.exists(source):
+        return None, None
+    accepted = flask.request.accept_encodings
+    for encoding, suffix in ENCODINGS.items():
+        variant = (variant_base or source) + suffix
+        if not accepted[encoding] or not os.path.exists(variant):
+            continue
+        if os.path.getmtime(variant) >= os.path.getmtime(source):
+            return encoding, variant
+    return None, None
+
+
+def install_static_assets(app, geo_dir=GEO_DIR, static_dir=STATIC_DIR):
+    """Serve precompressed script bundles and, if present, the map's topojson.
+
+    Parameters
+    ----------
+    app : dash.Dash
+    geo_dir : str
+        Directory of topojson files, named as plotly.js requests them
+        (e.g. `world_110m.json`)
+    static_dir : str
+        Directory of precompressed bundles, as `<package>/<path>.br` and `.gz`
+
+    Returns
+    -------
+    str or None
+        URL to use as the graphs' `topojsonURL` config, `None` to keep plotly.js'
+        default CDN since there are no local files
+    """
+    server = app.server
+
+    # Send precompressed variants from Dash's own component suites route, which
+    # still validates the path and sets the cache headers
+    endpoint = next(
+        rule.endpoint
+        for rule in server.url_map.iter_rules()
+        if rule.rule.endswith(
+            "_dash-component-suites/<string:package_name>/<path:fingerprinted_path>"
+        )
+    )
+    serve_component_suites = server.view_functions[endpoint]
+
+    @wraps(serve_component_suites)
+    def _serve_precompressed(package_name, fingerprinted_path):
+        response = serve_component_suites(package_name, fingerprinted_path)
+        if response.status_code != 200:
+            return response
+
+        path_in_pkg, _ = check_fingerprint(fingerprinted_path)
+        source = os.path.join(
+            os.path.dirname(sys.modules[package_name].__file__), path_in_pkg
+        )
+        encoding, variant = precompressed(
+            source, os.path.join(static_dir, package_name, path_in_pkg)
+        )
+        if encoding is not None:
+            with open(variant, "rb") as f:
+                response.set_data(f.read())
+            response.headers["Content-Encoding"] = encoding
+            # Unfingerprinted files carry an ETag, which must differ per encoding
+            etag, weak = response.get_etag()
+            if etag:
+                response.set_etag(f"{etag}:{encoding}", weak)
+        response.vary.add("Accept-Encoding")
+        return response
+
+    server.view_functions[endpoint] = _serve_precompressed
+
+    version = geo_version(geo_dir)
+    if version is None:
+        return None
+
+    prefix = app.config.routes_pathname_prefix
+
+    @server.route(prefix + "_happydash-geo/<fingerprint>/<name>.json")
+    def _topojson(fingerprint, name):
+        filename = name + ".json"
+        encoding, variant = precompressed(os.path.join(geo_dir, filename))
+        if encoding is not None:
+            filename = os.path.basename(variant)
+        # The URL changes with the files' contents, so they never need revalidating
+        response = flask.send_from_directory(
+            os.path.abspath(geo_dir),
+            filename,
+            mimetype="application/json",
+            max_age=ONE_YEAR,
+        )
+        response.cache_control.immutable = True
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return response
+
+    return app.get_relative_path(f"/_happydash-geo/{version}/")
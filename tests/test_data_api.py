@@ -0,0 +1,42 @@
+"""
+Regression tests for the `/api/v1` data API.
+
+Run from the repo root with `python -m pytest tests`.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(scope="module")
+def client():
+    import src.app as app_module
+
+    return app_module.app.server.test_client()
+
+
+@pytest.mark.parametrize("endpoint", ["rows", "means"])
+def test_empty_result_arrow(client, endpoint):
+    # No data before 2015: an empty stream that still carries the schema
+    response = client.get(f"/api/v1/{endpoint}?start=1990&end=1991&format=arrow")
+    assert response.status_code == 200
+    assert response.headers["X-Total-Count"] == "0"
+    table = pa.ipc.open_stream(response.data).read_all()
+    assert table.num_rows == 0
+    assert "country" in table.schema.names
+
+
+@pytest.mark.parametrize("endpoint", ["rows", "means"])
+def test_empty_result_json(client, endpoint):
+    response = client.get(f"/api/v1/{endpoint}?start=1990&end=1991&format=json")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["total"] == 0
+    assert body["rows"] == []
+    assert "country" in body["columns"]